@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+import glob
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import solution
+
+
+class Options:
+    jobs = 0
+    output = 'results.jsonl'
+    preview = 60
+    sources = []
+
+
+def find_files(sources):
+    ''' find_files:
+    The cipher files to crack, every file in each directory and every match
+    of each glob pattern, sorted.
+    '''
+    files = set()
+    for source in sources:
+        if os.path.isdir(source):
+            files.update(os.path.join(source, name)
+                         for name in os.listdir(source))
+        else:
+            files.update(glob.glob(source))
+
+    return sorted(name for name in files if os.path.isfile(name))
+
+
+def load_done(output):
+    ''' load_done:
+    The files already cracked in the results, so a run that was stopped
+    picks up where it left off.  A last line cut short by the stop is ignored
+    (and its file cracked again), as are the files that failed, so they get
+    another go.
+    '''
+    done = set()
+    if os.path.exists(output):
+        for line in open(output):
+            try:
+                record = json.loads(line)
+                if "error" not in record:
+                    done.add(record["file"])
+            except (ValueError, KeyError):
+                pass
+
+    return done
+
+
+def crack_file(filename):
+    ''' crack_file:
+    Cracks a file as `solution.py` would without asking, returning its
+    record: the passphrase (as latin-1 text, one character per byte), its
+    length and confidence, the euler checksum, the start of the decoded text
+    and how long it took.  A file that can't be cracked gets its error
+    instead, whatever went wrong, so one bad file doesn't stop the batch.
+    '''
+    start = time.time()
+    record = {"file": filename}
+    try:
+        ciphers = solution.load_ciphers(filename)
+        lengths = [solution.Options.length]
+        if not solution.Options.length:
+            lengths = [length for (score, length) in
+                       solution.rank_lengths(ciphers)
+                       [:solution.Options.lengths]]
+        ranked = solution.crack_lengths([ciphers[length] for length in lengths
+                                         if length in ciphers])
+        (confidence, length, phrase) = ranked[0]
+        cipher = ciphers[length]
+        record.update({
+            "key": str(bytearray(phrase)).decode('latin-1'),
+            "length": len(phrase),
+            "confidence": round(confidence, 4),
+            "checksum": cipher.get_euler(phrase),
+            "preview": cipher.decode(phrase, Options.preview)
+            .decode('latin-1'),
+        })
+    except Exception as error:
+        record["error"] = "{}: {}".format(type(error).__name__, error)
+    record["seconds"] = round(time.time() - start, 4)
+
+    return record
+
+
+def run():
+    ''' run:
+    Cracks each of the files not already in `Options.output`, across
+    `Options.jobs` processes, appending a JSON line for each to the results
+    as it finishes.
+    '''
+    files = find_files(Options.sources)
+    done = load_done(Options.output)
+    todo = [name for name in files if name not in done]
+    print("{} files, {} already done".format(len(files), len(files) -
+                                             len(todo)))
+
+    out = open(Options.output, 'a+')
+    out.seek(0, os.SEEK_END)
+    if out.tell():
+        out.seek(-1, os.SEEK_END)
+        if out.read(1) != '\n':
+            out.write('\n')
+
+    # the lengths of each file are cracked in turn, the files in parallel
+    solution.Options.jobs = 1
+    pool = None
+    if Options.jobs == 1:
+        records = (crack_file(name) for name in todo)
+    else:
+        pool = Pool(Options.jobs if Options.jobs > 0 else None)
+        records = pool.imap_unordered(crack_file, todo)
+
+    for record in records:
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+        out.flush()
+        if "error" in record:
+            print("{file}: {error}".format(**record))
+        else:
+            print("{}: {} (confidence {:.2f}, {:.2f}s)".format(
+                record["file"], record["key"].encode('unicode-escape'),
+                record["confidence"], record["seconds"]))
+
+    out.close()
+    if pool:
+        pool.close()
+        pool.join()
+
+
+if __name__ == "__main__":
+    nxt = None
+    if len(sys.argv) > 1:
+        def pjobs(x): Options.jobs = int(x)
+        def plength(x): solution.Options.length = int(x)
+        def pmax(x): solution.Options.max_length = int(x)
+        def poutput(x): Options.output = x
+        def ppreview(x): Options.preview = int(x)
+        for arg in sys.argv[1:]:
+            if arg.startswith('-'):
+                nxt = None
+                if arg in ['-b', '--binary']:
+                    solution.Options.binary = True
+                elif arg in ['-j', '--jobs']:
+                    nxt = pjobs
+                elif arg in ['-l', '--length']:
+                    nxt = plength
+                elif arg in ['-m', '--max-length']:
+                    nxt = pmax
+                elif arg in ['-o', '--output']:
+                    nxt = poutput
+                elif arg in ['-p', '--preview']:
+                    nxt = ppreview
+                elif arg in ['-s', '--stream']:
+                    solution.Options.stream = True
+            elif nxt:
+                nxt(arg)
+                nxt = None
+            else:
+                Options.sources.append(arg)
+
+    if not Options.sources:
+        sys.exit("usage: batch.py [options] DIRECTORY|GLOB ...")
+    run()
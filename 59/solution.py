@@ -1,75 +1,248 @@
 #!/usr/bin/env python
+import heapq
+import math
+import mmap
 import sys
+from multiprocessing import Pool
+try:
+    import numpy
+except ImportError:
+    numpy = None
 SEPARATOR = ','
+CHUNK = 1 << 20
+LETTERS = {
+    'a': 8.2, 'b': 1.5, 'c': 2.8, 'd': 4.3, 'e': 12.7, 'f': 2.2, 'g': 2.0,
+    'h': 6.1, 'i': 7.0, 'j': 0.15, 'k': 0.8, 'l': 4.0, 'm': 2.4, 'n': 6.7,
+    'o': 7.5, 'p': 1.9, 'q': 0.1, 'r': 6.0, 's': 6.3, 't': 9.1, 'u': 2.8,
+    'v': 1.0, 'w': 2.4, 'x': 0.15, 'y': 2.0, 'z': 0.07,
+}
+PUNCTUATION = ".,;:'\"!?()-"
+COMMON_WORDS = frozenset("""
+    a about after all also an and any are as at be because been but by can
+    come could day do even first for from get give go good have he her him his
+    how i if in into is it its just know like look make me more most my new no
+    not now of on one only or other our out over people say see she so some
+    take than that the their them then there these they this time to two up
+    us use very want was way we well were what when which who will with would
+    year you your
+    """.split())
+
+
+def english_weights():
+    ''' english_weights:
+    The log of how likely each byte is as a character of English text, from
+    the letter frequencies (mostly lower case), the space between words and a
+    little punctuation.  Other printable characters are unlikely and anything
+    else is all but impossible.
+    '''
+    chance = [1e-8] * 256
+    for code in range(32, 127):
+        chance[code] = 5e-4
+    for char in '\n\t0123456789':
+        chance[ord(char)] = 1e-3
+    for char in PUNCTUATION:
+        chance[ord(char)] = 0.03 / len(PUNCTUATION)
+    chance[ord(' ')] = 0.17
+    for (char, percent) in LETTERS.items():
+        chance[ord(char)] = percent / 100 * 0.78 * 0.95
+        chance[ord(char.upper())] = percent / 100 * 0.78 * 0.05
+
+    return [math.log(value) for value in chance]
+
+WEIGHTS = english_weights()
+# XOR_TABLES[key] translates a string of bytes by XORing each with key
+XOR_TABLES = [str(bytearray(num ^ key for num in range(256)))
+              for key in range(256)]
+# XOR_WEIGHTS[key][num] is the weight of num decoded with key
+XOR_WEIGHTS = None if numpy is None else \
+    numpy.array(WEIGHTS)[numpy.arange(256)[:, None] ^ numpy.arange(256)]
+# the score expected of English text, the mean weight of its characters
+ENGLISH = sum(math.exp(weight) * weight for weight in WEIGHTS)
+WORD_WEIGHT = 2.0
+COMMON_SHARE = 0.3
 
 
 class Options:
+    binary = False
     debug = False
     euler = False
     filename = 'cipher1.txt'
-    length = 3
+    candidates = 5
+    interactive = False
+    jobs = 0
+    length = None
+    lengths = 3
+    max_length = 20
+    output = None
+    prefix = 200
+    stream = False
     target = ' '
+    tries = 1000
+
+
+def histograms(text, length, phase=0):
+    ''' histograms:
+    The count of each byte value in the text for each of the `length`
+    passphrase characters, the text starting at passphrase character
+    `phase`.  With numpy a bincount over a strided view of the text per
+    passphrase character, otherwise a count of each byte value over a strided
+    copy.
+    '''
+    if numpy is not None:
+        text = numpy.frombuffer(text, numpy.uint8)
+    counts = []
+    for pos in range(length):
+        part = text[(pos - phase) % length::length]
+        if numpy is not None:
+            counts.append(numpy.bincount(part, minlength=256))
+        else:
+            counts.append([part.count(chr(num)) for num in range(256)])
+
+    return counts
+
+
+def xor(text, phrase, phase=0):
+    ''' xor:
+    The text XORed with the passphrase, starting at passphrase character
+    `phase`.  Each passphrase character translates its strided slice of the
+    text in one go.
+    '''
+    plain = bytearray(len(text))
+    for (pos, key) in enumerate(phrase):
+        start = (pos - phase) % len(phrase)
+        plain[start::len(phrase)] = \
+            text[start::len(phrase)].translate(XOR_TABLES[key])
+
+    return str(plain)
+
+
+def read_chunks(filename):
+    ''' read_chunks:
+    Reads the cipher text `CHUNK` bytes at a time, yielding each chunk as a
+    bytearray of the character codes.  The comma separated file is parsed a
+    chunk at a time (with numpy in one go), the part number at the end held
+    back for the next chunk.  With `--binary` the file is the raw bytes and
+    is memory mapped instead.
+    '''
+    f = open(filename, 'rb')
+    if Options.binary:
+        if not len(f.read(1)):
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for start in xrange(0, len(mapped), CHUNK):
+            yield bytearray(mapped[start:start + CHUNK])
+        mapped.close()
+        return
+
+    rest = ''
+    while True:
+        data = f.read(CHUNK)
+        text = rest + data
+        end = max(text.rfind(SEPARATOR), text.rfind('\n')) + 1 \
+            if data else len(text)
+        (text, rest) = (text[:end], text[end:])
+        if text.strip():
+            text = text.replace(SEPARATOR, ' ')
+            if numpy is not None:
+                # fromstring stops quietly at a bad number, so count them
+                nums = numpy.fromstring(text, numpy.int64, sep=' ')
+                if len(nums) != len(text.split()):
+                    raise ValueError("invalid number after {}".format(
+                        ",".join(str(num) for num in nums[-3:])))
+                if len(nums) and (nums.min() < 0 or nums.max() > 255):
+                    raise ValueError("byte must be in range(0, 256)")
+                yield bytearray(nums.astype(numpy.uint8).tostring())
+            else:
+                yield bytearray(int(num) for num in text.split())
+        if not data:
+            return
 
 
 class Cipher:
     ''' Cipher:
-    Wrapper object for a cipher text.  Keeps an array of each character that
-    correlates to a character in an XOR passphrase.  After the cipher text is
-    loaded, will find the most common characters for each and (assume) they are
-    spaces.
+    Wrapper object for a cipher text.  Keeps the text as a bytearray (a byte
+    per character) and the count of each character for each character of the
+    XOR passphrase, the histograms that find the passphrase.  Without `keep`
+    only the first `Options.prefix` characters are kept and the histograms
+    are counted as the text is loaded, so the whole text is never in memory.
     '''
-    def __init__(self, phrase_length):
+    def __init__(self, phrase_length, keep=True):
         self.length = phrase_length
-        self.chars = []
-        self.base = []
-        self.pos = 0
+        self.keep = keep
+        self.base = bytearray()
+        self.size = 0
+        self.chars = None if keep else histograms('', phrase_length)
 
-        for i in range(self.length):
-            self.chars.append({})
+    def split(self, length):
+        ''' (public) split:
+        The same text (shared, not copied) with another passphrase length.
+        '''
+        cipher = Cipher(length)
+        cipher.base = self.base
+        cipher.size = self.size
+        return cipher
 
-    def __add(self, num):
-        ''' (private) __add
-        Adds the character to the current position in the cipher passphrase,
-        cycling the position and incrementing the count for each character.
+    def counts(self):
+        ''' (public) counts:
+        The histograms of the text, for each passphrase character a list of
+        the count of each byte it encodes (see `histograms`).  For a kept
+        text these are worked out on the first call after loading.
         '''
-        self.base.append(num)
-        if num in self.chars[self.pos]:
-            self.chars[self.pos][num] += 1
-        else:
-            self.chars[self.pos][num] = 1
+        if self.chars is None:
+            self.chars = histograms(self.base, self.length)
 
-        self.pos += 1
-        if self.pos >= self.length:
-            self.pos = 0
+        return self.chars
 
     def load_line(self, line):
         ''' (public) load_line:
         Loads a line of characters from a file, will break apart the line and
-        increment the value count for the corresponding passphrase character.
+        add each character code to the text.
+        '''
+        self.load(int(num) for num in line.split(SEPARATOR))
+
+    def load(self, nums):
+        ''' (public) load:
+        Adds each of the character codes (0 to 255) in turn, as from
+        `load_line` or a chunk of `read_chunks`.  Unless the text is kept the
+        chunk's histograms are added to the running ones.
+        '''
+        chunk = nums if isinstance(nums, bytearray) else bytearray(nums)
+        if self.keep:
+            self.base.extend(chunk)
+            self.chars = None
+        else:
+            self.base.extend(chunk[:max(0, Options.prefix - len(self.base))])
+            more = histograms(chunk, self.length, self.size % self.length)
+            if numpy is not None:
+                self.chars = [old + new for (old, new) in zip(self.chars, more)]
+            else:
+                self.chars = [map(sum, zip(old, new))
+                              for (old, new) in zip(self.chars, more)]
+        self.size += len(chunk)
+
+    def coincidence(self):
+        ''' (public) coincidence:
+        The index of coincidence of the text, the chance that two characters
+        encoded by the same passphrase character are the same, averaged over
+        the passphrase.  For the right length each of those is a single byte
+        XOR of English, which keeps the uneven letter counts (around 0.07),
+        while a wrong length mixes keys and flattens them out.
         '''
-        nums = line.split(SEPARATOR)
-        for num in nums:
-            self.__add(int(num))
+        total = 0.0
+        for char in self.counts():
+            count = sum(char)
+            if count > 1:
+                total += sum(cnt * (cnt - 1) for cnt in char) / \
+                    float(count * (count - 1))
+
+        return total / self.length
 
     def __words(self, phrase, cnt=5):
         ''' (private) __words:
         Finds the first `cnt` "words" (space separated strings) using the
         provided phrase as the decoder.  Returns as a single string.
         '''
-        word = []
-        pos = 0
-        space_cnt = 0
-        for i in range(len(self.base)):
-            char = self.base[pos] ^ phrase[pos % self.length]
-            if char == ord(' '):
-                space_cnt += 1
-                if space_cnt > cnt:
-                    break
-
-            word.append(char)
-            pos += 1
-
-        return ''.join(map(unichr, word))
+        return ' '.join(self.decode(phrase).split(' ')[:cnt + 1])
 
     def test(self):
         ''' (public) test:
@@ -83,11 +256,12 @@ class Cipher:
         base = 0
         bin_cnt = 0
         word_cnt = 10 if Options.debug else 3
+        orders = [sorted(range(256), key=lambda num: -char[num])
+                  for char in self.counts()]
         while True:
             phrase = []
             i = 0
-            for char in self.chars:
-                char_set = sorted(char, key=char.get, reverse=True)
+            for char_set in orders:
                 phrase.append(char_set[index[i]] ^ ord(Options.target))
                 i += 1
 
@@ -110,47 +284,327 @@ class Cipher:
                     index[i] = base + (c % 2)
                     c = c / 2
 
+    def __column(self, pos):
+        ''' (private) __column:
+        Scores every key byte for the passphrase character at `pos` by how
+        English the characters it decodes to are, the mean of their
+        `WEIGHTS`.  Only needs the counts of the position, not the text, and
+        with numpy is a single product of `XOR_WEIGHTS` with them.
+        Returns the best `Options.candidates` as (score, key byte) pairs, best
+        first.
+        '''
+        char = self.counts()[pos]
+        total = float(sum(char)) or 1.0
+        if XOR_WEIGHTS is not None:
+            scores = zip((XOR_WEIGHTS.dot(char) / total).tolist(), range(256))
+        else:
+            counts = [(num, cnt) for (num, cnt) in enumerate(char) if cnt]
+            scores = [(sum(WEIGHTS[num ^ key] * cnt for (num, cnt) in counts) /
+                       total, key) for key in range(256)]
+        return heapq.nlargest(Options.candidates, scores)
+
+    def decode(self, phrase, length=None):
+        ''' (public) decode:
+        Decodes the first `length` characters (all of them by default) with
+        the passphrase, returned as a string (see `xor`).  Only the prefix
+        can be decoded when the text isn't kept.
+        '''
+        return xor(self.base if length is None else self.base[:length], phrase)
+
+    def crack(self):
+        ''' (public) crack:
+        Finds the passphrase without asking, returning it with a confidence
+        between 0 and 1.  Each passphrase character is scored on its own from
+        the counts (see `__column`), and whole phrases come out of a heap best
+        first by the mean of their character scores.  A phrase's full score
+        adds `WORD_WEIGHT` times the share of common English words in its
+        first `Options.prefix` characters, the only part of the text decoded.
+        As that share is at most 1, the search stops once the character score
+        of the next phrase plus the weight can't beat the best so far (or
+        after `Options.tries` phrases).  The confidence is how far ahead of
+        the others the best phrase is, treating the scores as log likelihoods
+        of the prefix.  As the best of a wrong length is still ahead of the
+        rest, that is scaled down by how far its character score falls short
+        of `ENGLISH` and when fewer than `COMMON_SHARE` of its words are common.
+        '''
+        columns = [self.__column(pos) for pos in range(self.length)]
+        # mean of the character scores, weighted by how many each one decodes
+        shares = [sum(self.counts()[pos]) / float(self.size or 1)
+                  for pos in range(self.length)]
+
+        def total(index):
+            return sum(columns[pos][i][0] * shares[pos]
+                       for (pos, i) in enumerate(index))
+
+        start = tuple([0] * self.length)
+        heap = [(-total(start), start)]
+        seen = set([start])
+        scored = []
+        best = None
+        while heap and len(scored) < Options.tries:
+            (score, index) = heapq.heappop(heap)
+            if best is not None and -score + WORD_WEIGHT <= best:
+                break
+            phrase = [columns[pos][i][1] for (pos, i) in enumerate(index)]
+            common = self.__common(phrase)
+            score = -score + WORD_WEIGHT * common
+            scored.append((score, common, phrase))
+            if best is None or score > best:
+                best = score
+            for pos in range(self.length):
+                if index[pos] + 1 < len(columns[pos]):
+                    near = index[:pos] + (index[pos] + 1,) + index[pos + 1:]
+                    if near not in seen:
+                        seen.add(near)
+                        heapq.heappush(heap, (-total(near), near))
+
+        (score, common, phrase) = max(scored)
+        length = min(self.size, Options.prefix)
+        confidence = 1 / sum(math.exp(max(-50, (other - score) * length))
+                             for (other, _, _) in scored)
+        chars = score - WORD_WEIGHT * common
+        return phrase, confidence * math.exp(min(0.0, chars - ENGLISH)) * \
+            min(1.0, common / COMMON_SHARE)
+
+    def __common(self, phrase):
+        ''' (private) __common:
+        The share of the whole words in the decoded prefix that are common
+        English words.
+        '''
+        words = self.decode(phrase, Options.prefix).lower().split()
+        if self.size > Options.prefix:
+            words = words[:-1]
+        words = [word.strip(PUNCTUATION) for word in words]
+        if not words:
+            return 0.0
+        return sum(word in COMMON_WORDS for word in words) / float(len(words))
+
     def get_euler(self, phrase):
         ''' (public) get_euler:
         Calculates the sum of the unciphered character for the provided phrase
-        and returns it.
+        and returns it.  A phrase that fits the passphrase length is summed
+        from the histograms, each count times the byte it decodes to, with no
+        decoding at all.
         '''
-        char_sum = 0
-        for i in range(len(self.base)):
-            char_sum += self.base[i] ^ phrase[i % len(phrase)]
+        if self.length % len(phrase) == 0:
+            phrase = phrase * (self.length / len(phrase))
+            if numpy is not None:
+                return int(sum(char.dot(numpy.arange(256) ^ key)
+                               for (char, key) in zip(self.counts(), phrase)))
+            return sum(cnt * (num ^ key)
+                       for (char, key) in zip(self.counts(), phrase)
+                       for (num, cnt) in enumerate(char))
+
+        plain = self.decode(phrase)
+        if numpy is not None:
+            return int(numpy.frombuffer(plain, numpy.uint8).sum(
+                dtype=numpy.int64))
+        return sum(bytearray(plain))
+
 
-        return char_sum
+def rank_lengths(ciphers):
+    ''' rank_lengths:
+    Ranks the passphrase lengths of the ciphers (by length) by the index of
+    coincidence of the text split that many ways (see `Cipher.coincidence`),
+    best first as (index, length) pairs.  A length is left out when one of
+    its divisors (1 included) scores nearly as high, splitting the text
+    further shows nothing new, which drops both the multiples of the right
+    length and the lengths no better than a single key.
+    '''
+    scores = dict((length, cipher.coincidence())
+                  for (length, cipher) in ciphers.items())
+
+    return sorted(((score, length) for (length, score) in scores.items()
+                   if not any(scores.get(short, 0) >= score * 0.9
+                              for short in range(1, length)
+                              if length % short == 0)),
+                  key=lambda (score, length): (-score, length))
+
+
+def shortest_period(phrase):
+    ''' shortest_period:
+    The passphrase without repeats, `[1, 2, 1, 2]` decodes the same as
+    `[1, 2]`.
+    '''
+    for length in range(1, len(phrase)):
+        if len(phrase) % length == 0 and \
+                phrase == phrase[:length] * (len(phrase) / length):
+            return phrase[:length]
+
+    return phrase
+
+
+def crack_length(cipher):
+    ''' crack_length:
+    Cracks the cipher, as a worker for `crack_lengths`.  Returns the
+    confidence, length and phrase.
+    '''
+    phrase, confidence = cipher.crack()
+    return confidence, cipher.length, shortest_period(phrase)
+
+
+def crack_lengths(ciphers):
+    ''' crack_lengths:
+    Cracks each of the ciphers (the same text with different passphrase
+    lengths), in worker processes when there is more than one, and returns
+    the results of `crack_length` across all of them ranked by confidence
+    (the shorter phrase first on a tie).  Lengths that end up with the same
+    phrase are only listed once.  Raises a ValueError when there are no
+    ciphers (see `load_ciphers`).
+    '''
+    if not ciphers:
+        raise ValueError("the text is shorter than the passphrase")
+    if len(ciphers) == 1 or Options.jobs == 1:
+        results = map(crack_length, ciphers)
+    else:
+        pool = Pool(Options.jobs if Options.jobs > 0 else None)
+        results = pool.map(crack_length, ciphers)
+        pool.close()
+        pool.join()
+
+    ranked = []
+    for (confidence, length, phrase) in sorted(
+            results, key=lambda (confidence, length, phrase):
+            (-confidence, len(phrase), length)):
+        if phrase not in [other for (_, _, other) in ranked]:
+            ranked.append((confidence, length, phrase))
+
+    return ranked
+
+
+def write_plain(filename, phrase, out):
+    ''' write_plain:
+    Decodes the file a chunk at a time to `out`, so only a chunk of it is
+    ever in memory.
+    '''
+    done = 0
+    for chunk in read_chunks(filename):
+        out.write(xor(chunk, phrase, done % len(phrase)))
+        done += len(chunk)
+
+
+def load_ciphers(filename):
+    ''' load_ciphers:
+    Loads the provided file into a cipher for each passphrase length tried,
+    `--length` or those up to `--max-length`, returned by length.  With
+    `--stream` (or `--binary`) the file is read a chunk at a time into
+    ciphers that only count the characters, otherwise it is all read in and
+    shared between them.  Lengths longer than the text are left out, so
+    there may be none left for a short text and a long `--length`.
+    '''
+    lengths = [Options.length] if Options.length else \
+        range(1, Options.max_length + 1)
+    if Options.stream or Options.binary:
+        ciphers = dict((length, Cipher(length, keep=False))
+                       for length in lengths)
+        for chunk in read_chunks(filename):
+            for cipher in ciphers.values():
+                cipher.load(chunk)
+        size = ciphers[lengths[0]].size
+        ciphers = dict((length, cipher) for (length, cipher) in ciphers.items()
+                       if length <= max(size, 1))
+    else:
+        f = open(filename, 'r')
+        cipher = Cipher(Options.length or 1)
+
+        for line in f:
+            cipher.load_line(line)
+        ciphers = dict((length, cipher.split(length)) for length in lengths
+                       if length <= max(cipher.size, 1))
+
+    return ciphers
+
+
+def show(text):
+    ''' show:
+    Prints a line of the results, to stderr when the decoded text is going
+    to stdout (`-o -`) so the two don't mix.
+    '''
+    out = sys.stderr if Options.output == '-' else sys.stdout
+    out.write(text + "\n")
 
 
 def load_file(filename):
     ''' load_file:
-    Loads the provided file and runs it through the cipher system.
+    Loads the provided file and runs it through the cipher system.  Without a
+    `--length` the top `Options.lengths` of `rank_lengths` are tried.
     '''
-    f = open(filename, 'r')
-    cipher = Cipher(Options.length)
-
-    for line in f:
-        cipher.load_line(line)
+    ciphers = load_ciphers(filename)
+    if Options.length not in ciphers and Options.length:
+        sys.exit("the text is shorter than the passphrase")
+    lengths = [Options.length]
+    if not Options.length:
+        ranked = rank_lengths(ciphers)
+        if Options.debug:
+            for (score, length) in ranked:
+                show("Length {:>3}: coincidence {:.4f}".format(length, score))
+        lengths = [length for (score, length) in ranked[:Options.lengths]]
 
-    phrase = cipher.test()
+    if Options.interactive:
+        cipher = ciphers[lengths[0]]
+        phrase = cipher.test()
+    else:
+        ranked = crack_lengths([ciphers[length] for length in lengths])
+        if Options.debug:
+            for (confidence, length, phrase) in ranked:
+                show("Length {:>3}: {} (confidence {:.2f})".format(
+                    length, ''.join(map(chr, phrase)), confidence))
+        (confidence, length, phrase) = ranked[0]
+        cipher = ciphers[length]
+        show("Passphrase: {} (confidence {:.2f})".format(
+            ''.join(map(chr, phrase)), confidence))
+        if Options.debug:
+            show("Starts: {}".format(cipher.decode(phrase, Options.prefix)))
+    if Options.output:
+        out = sys.stdout if Options.output == '-' else open(Options.output, 'wb')
+        write_plain(filename, phrase, out)
+        if out is not sys.stdout:
+            out.close()
     if Options.euler:
-        print("euler answer: {}".format(cipher.get_euler(phrase)))
+        show("euler answer: {}".format(cipher.get_euler(phrase)))
 
 
 if __name__ == "__main__":
     nxt = None
     if len(sys.argv) > 1:
+        def pcandidates(x): Options.candidates = int(x)
+        def pjobs(x): Options.jobs = int(x)
         def plength(x): Options.length = int(x)
+        def plengths(x): Options.lengths = int(x)
+        def pmax(x): Options.max_length = int(x)
+        def poutput(x): Options.output = x
+        def pprefix(x): Options.prefix = int(x)
+        def ptries(x): Options.tries = int(x)
         def ctarget(x): Options.target = x
         for arg in sys.argv[1:]:
-            if arg.startswith('-'):
+            if arg.startswith('-') and arg != '-':
                 nxt = None
-                if arg in ['-d', '--debug']:
+                if arg in ['-b', '--binary']:
+                    Options.binary = True
+                elif arg in ['-d', '--debug']:
                     Options.debug = True
                 elif arg in ['-e', '--euler']:
                     Options.euler = True
+                elif arg in ['-i', '--interactive']:
+                    Options.interactive = True
+                elif arg in ['-j', '--jobs']:
+                    nxt = pjobs
                 elif arg in ['-l', '--length']:
                     nxt = plength
+                elif arg in ['-k', '--lengths']:
+                    nxt = plengths
+                elif arg in ['-m', '--max-length']:
+                    nxt = pmax
+                elif arg in ['-c', '--candidates']:
+                    nxt = pcandidates
+                elif arg in ['-o', '--output']:
+                    nxt = poutput
+                elif arg in ['-p', '--prefix']:
+                    nxt = pprefix
+                elif arg in ['-s', '--stream']:
+                    Options.stream = True
+                elif arg in ['--tries']:
+                    nxt = ptries
                 elif arg in ['-t', '--target']:
                     nxt = ctarget
             else:
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+import json
+import os
+import random
+import resource
+import sys
+import time
+from multiprocessing import Pool
+
+import solution
+from generate import solved_grid
+
+CORPORA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpora")
+BASELINE = os.path.join(CORPORA, "baseline.json")
+TIERS = [
+    ("easy", os.path.join(CORPORA, "easy.txt")),
+    ("euler", os.path.join(CORPORA, os.pardir, "sudoku.txt")),
+    ("hard", os.path.join(CORPORA, "hard.txt")),
+    ("adversarial", os.path.join(CORPORA, "hard.txt")),
+]
+
+
+class Options:
+    boards = 10
+    clues = 0.6
+    engine = "propagate"
+    compact = True
+    repeat = 5
+    save = False
+    seed = 96
+    sizes = [2, 3, 4, 5]
+    suite = False
+    tolerance = 0.5
+
+
+def make_puzzle(size, clues, rand):
+    ''' make_puzzle:
+    Blanks out all but the `clues` fraction of the cells of a random full
+    board, returning the lines of text for its rows (see `parse_row`).  The
+    puzzles aren't checked for a unique solution, any solution will do for
+    timing the solver.
+    '''
+    grid = solved_grid(size, rand)
+    width = size * size
+    cells = range(width * width)
+    rand.shuffle(cells)
+    for cell in cells[:int(len(cells) * (1 - clues))]:
+        grid[cell / width][cell % width] = 0
+
+    return ["".join(solution.SYMBOLS[value] for value in row)
+            for row in grid]
+
+
+def bench_size(size, rand):
+    ''' bench_size:
+    Times solving `Options.boards` puzzles with `size` x `size` squares.
+    Returns the sorted times and the number solved.
+    '''
+    solution.Options.size = size
+    times = []
+    solved = 0
+    for i in range(Options.boards):
+        rows = make_puzzle(size, Options.clues, rand)
+        start = time.time()
+        board = solution.solve(solution.build_board(rows))
+        times.append(time.time() - start)
+        solved += board.is_complete()
+
+    return sorted(times), solved
+
+
+def load_tier(name, filename):
+    ''' load_tier:
+    Reads the boards of a corpus file, returning the lines of text for each.
+    The adversarial tier is made from the hard boards by `adversarial`.
+    '''
+    grids = [rows for (header, rows) in solution.read_grids(open(filename))]
+    if name == "adversarial":
+        grids = [adversarial(rows) for rows in grids]
+
+    return grids
+
+
+def adversarial(rows):
+    ''' adversarial:
+    Relabels the numbers of a board so that the top row of its solution reads
+    987654321, which makes the solver's lowest-candidate-first guesses wrong
+    as often as they can be.
+    '''
+    board = solution.CompactBoard(3)
+    for i in range(9):
+        board.load_row(rows[i], i)
+    answers = solution.solve(board).values()
+    labels = dict(zip(answers[:9], range(9, 0, -1)))
+    labels[0] = 0
+    return ["".join(str(labels[value]) for value in
+                    solution.parse_row(row, 9)) for row in rows]
+
+
+def bench_tier(grids):
+    ''' bench_tier:
+    Solves each of the boards `Options.repeat` times, timing each solve.  This
+    runs in its own process so the peak memory is that of the tier.  Returns
+    the sorted times, the number of boards solved (on the last run) and the
+    peak memory in KB.
+    '''
+    times = []
+    for run in range(Options.repeat):
+        solved = 0
+        for rows in grids:
+            start = time.time()
+            try:
+                board = solution.solve(solution.build_board(rows))
+                solved += board.is_complete()
+            except (solution.CollisionError, solution.NoPossibilityError):
+                pass
+            times.append(time.time() - start)
+
+    return (sorted(times), solved,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def run_suite():
+    ''' run_suite:
+    Times each tier of the corpora (see `TIERS`), printing the median and p99
+    time per board and the peak memory next to the stored baseline for the
+    solver configuration.  With `--save` the results of each fully solved tier
+    become its new baseline, otherwise returns whether anything regressed
+    past the baseline by more than `Options.tolerance`, or solved fewer boards.
+    '''
+    config = "{}-{}".format("compact" if Options.compact else "object",
+                            Options.engine)
+    baselines = json.load(open(BASELINE)) if os.path.exists(BASELINE) else {}
+    baseline = baselines.get(config, {})
+    results = {}
+    regressed = False
+    print("{:<12} {:>6} {:>7} {:>10} {:>10} {:>9}  {}".format(
+        "tier", "boards", "solved", "median ms", "p99 ms", "peak KB",
+        "baseline ({})".format(config)))
+    for (name, filename) in TIERS:
+        grids = load_tier(name, filename)
+        pool = Pool(1)
+        times, solved, memory = pool.apply(bench_tier, (grids,))
+        pool.terminate()
+        result = {
+            "median": solution.percentile(times, 50) * 1000,
+            "p99": solution.percentile(times, 99) * 1000,
+            "memory": memory,
+            "solved": solved,
+        }
+        if solved == len(grids):
+            results[name] = result
+
+        status = "-"
+        if name in baseline and not Options.save:
+            worse = ["{} {:.4g} > {:.4g}".format(key, result[key],
+                                                 baseline[name][key])
+                     for key in ["median", "p99", "memory"]
+                     if result[key] > baseline[name][key] *
+                     (1 + Options.tolerance)]
+            if solved < baseline[name].get("solved", 0):
+                worse.append("solved {} < {}".format(
+                    solved, baseline[name]["solved"]))
+            status = "REGRESSED " + ", ".join(worse) if worse else "ok"
+            regressed = regressed or bool(worse)
+        print("{:<12} {:>6} {:>7} {:>10.3f} {:>10.3f} {:>9}  {}".format(
+            name, len(grids), "{}/{}".format(solved, len(grids)),
+            result["median"], result["p99"], memory, status))
+
+    if Options.save:
+        unsolved = [name for (name, filename) in TIERS if name not in results]
+        if unsolved:
+            print("not saving unsolved tiers: " + ", ".join(unsolved))
+        baseline.update(results)
+        baselines[config] = baseline
+        json.dump(baselines, open(BASELINE, 'w'), indent=2, sort_keys=True)
+        print("saved baseline for " + config)
+
+    return regressed
+
+
+def run():
+    ''' run:
+    Benchmarks each of the board sizes and prints how the solve times scale.
+    '''
+    rand = random.Random(Options.seed)
+    print("{:>4} {:>6} {:>7} {:>10} {:>10} {:>10}".format(
+        "size", "board", "solved", "mean ms", "p50 ms", "max ms"))
+    for size in Options.sizes:
+        times, solved = bench_size(size, rand)
+        print("{:>4} {:>6} {:>7} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            size, "{0}x{0}".format(size * size),
+            "{}/{}".format(solved, len(times)),
+            sum(times) / len(times) * 1000,
+            solution.percentile(times, 50) * 1000, times[-1] * 1000))
+
+
+if __name__ == "__main__":
+    nxt = None
+    if len(sys.argv) > 1:
+        def pboards(x): Options.boards = int(x)
+        def pclues(x): Options.clues = float(x)
+        def pengine(x): Options.engine = x
+        def prepeat(x): Options.repeat = int(x)
+        def pseed(x): Options.seed = int(x)
+        def psizes(x): Options.sizes = [int(size) for size in x.split(",")]
+        def ptolerance(x): Options.tolerance = float(x)
+        for arg in sys.argv[1:]:
+            if arg.startswith('-'):
+                nxt = None
+                if arg in ['-b', '--boards']:
+                    nxt = pboards
+                elif arg in ['-c', '--clues']:
+                    nxt = pclues
+                elif arg in ['--engine']:
+                    nxt = pengine
+                elif arg in ['-o', '--object']:
+                    Options.compact = False
+                elif arg in ['--seed']:
+                    nxt = pseed
+                elif arg in ['-n', '--sizes']:
+                    nxt = psizes
+                elif arg in ['-r', '--repeat']:
+                    nxt = prepeat
+                elif arg in ['--save']:
+                    Options.save = True
+                elif arg in ['-s', '--suite']:
+                    Options.suite = True
+                elif arg in ['-t', '--tolerance']:
+                    nxt = ptolerance
+            elif nxt:
+                nxt(arg)
+                nxt = None
+
+    if Options.engine == "batch":
+        sys.exit("benchmark.py times one board at a time, the batch engine "
+                 "solves whole files (time it with solution.py)")
+    solution.Options.compact = Options.compact
+    solution.Options.engine = Options.engine
+    if Options.suite:
+        sys.exit(1 if run_suite() else 0)
+    run()
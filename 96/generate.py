@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+import random
+import sys
+from itertools import izip
+from multiprocessing import Pool
+
+import solution
+
+DIFFICULTIES = ["easy", "medium", "hard"]
+
+
+class Options:
+    boards = 10
+    clues = 0
+    difficulty = "any"
+    jobs = 1
+    seed = 96
+    size = 3
+    start = 1
+    tries = 100
+
+
+def solved_grid(size, rand):
+    ''' solved_grid:
+    Builds a random full board with `size` x `size` squares, starting from the
+    usual shifted pattern then relabelling the numbers and shuffling the rows
+    in each band, the bands, the columns in each stack and the stacks.
+    Returns the values as a list of rows.
+    '''
+    width = size * size
+    labels = range(1, width + 1)
+    rand.shuffle(labels)
+
+    def order():
+        bands = range(size)
+        rand.shuffle(bands)
+        lines = []
+        for band in bands:
+            offsets = range(size)
+            rand.shuffle(offsets)
+            lines += [band * size + offset for offset in offsets]
+        return lines
+
+    rows = order()
+    columns = order()
+    return [[labels[(size * (row % size) + row / size + column) % width]
+             for column in columns] for row in rows]
+
+
+def load(values, size):
+    ''' load:
+    Returns a CompactBoard with the given values (0 for blanks) answered.
+    '''
+    board = solution.CompactBoard(size)
+    for (index, value) in enumerate(values):
+        if value:
+            board.set_answer(index, value)
+
+    return board
+
+
+def rate(values, size):
+    ''' rate:
+    The difficulty of a board, by what the solver needs to solve it:
+    - easy, clipping the answered cells from their peers is enough
+    - medium, also needs the exclusives (hidden singles, pointing and shares)
+    - hard, needs to guess
+    '''
+    board = load(values, size)
+    board.full_clip()
+    if board.is_complete():
+        return "easy"
+    found = 1
+    while found:
+        found = board.exclusives()
+
+    return "medium" if board.is_complete() else "hard"
+
+
+def still_unique(board, mark, kept, values, index, answer):
+    ''' still_unique:
+    Whether a board that had a unique solution with `answer` at `index` still
+    does with that cell blanked.  Any other solution has to have something
+    else at `index` (otherwise it solves the board before the blanking), so
+    this is just a search for a solution with `answer` ruled out there.  The
+    search is skipped when the cell's answered peers leave only `answer`, or
+    when none of the other blanks in one of its units can take `answer`.
+    The search runs on the shared board of `dig`, unwound to the cell's
+    `mark` with the `kept` clues put back on top.
+    '''
+    geo = solution.geometry(board.size)
+    taken = set(values[peer] for peer in geo.peers[index])
+    taken.discard(0)
+    if len(taken) == geo.width - 1:
+        return True
+    for unit in geo.cell_units[index]:
+        if not any(cell != index and not values[cell] and answer not in
+                   [values[peer] for peer in geo.peers[cell]]
+                   for cell in geo.units[unit]):
+            return True
+
+    board.undo(*mark)
+    try:
+        for cell in kept:
+            if not board.is_solved(cell):
+                board.set_answer(cell, values[cell])
+        board.remove_possibility(index, answer)
+        board = solution.search(board)
+    except (solution.CollisionError, solution.NoPossibilityError):
+        return True
+
+    return not board.is_complete()
+
+
+def dig(values, size, rand):
+    ''' dig:
+    Blanks out cells of a full board in a random order, putting back any that
+    would leave more than one solution (or, for an easy or medium board, make
+    it harder than that), until the board is down to `Options.clues` clues
+    or no more can be taken out.  Returns the values of the puzzle.
+
+    The uniqueness checks share one CompactBoard instead of loading the
+    puzzle afresh for each cell.  It is filled in the reverse of the order
+    the cells are tried, propagating after each, and the trail position
+    before each cell is kept.  Unwinding to a cell's position leaves the
+    propagated board of the cells still to be tried, only the clues kept so
+    far need putting back (see `still_unique`).
+    '''
+    cells = range(len(values))
+    rand.shuffle(cells)
+    board = solution.CompactBoard(size)
+    board.trail = []
+    marks = {}
+    for index in reversed(cells):
+        marks[index] = (len(board.trail), board.solved)
+        if not board.is_solved(index):
+            board.set_answer(index, values[index])
+            solution.deduce(board)
+
+    clues = len(values)
+    kept = []
+    limit = DIFFICULTIES.index(Options.difficulty) \
+        if Options.difficulty in DIFFICULTIES[:2] else None
+    for index in cells:
+        if clues <= Options.clues:
+            break
+        answer = values[index]
+        values[index] = 0
+        if not still_unique(board, marks[index], kept, values, index,
+                            answer) or limit is not None \
+                and DIFFICULTIES.index(rate(values, size)) > limit:
+            values[index] = answer
+            kept.append(index)
+        else:
+            clues -= 1
+
+    return values
+
+
+def generate(number):
+    ''' generate:
+    Makes the board `number` of the run, each board has its own random seed
+    made from `Options.seed` and its number so the output doesn't depend on
+    how the boards are split across jobs.  Boards not of `--difficulty` are
+    thrown away and retried, up to `Options.tries` times.  Returns the lines
+    of the board in the puzzle file format, or None if it ran out of tries.
+    '''
+    size = Options.size
+    rand = random.Random((Options.seed << 32) + number)
+    for attempt in range(Options.tries):
+        values = dig(sum(solved_grid(size, rand), []), size, rand)
+        if Options.difficulty in ["any", rate(values, size)]:
+            break
+    else:
+        return None
+
+    width = size * size
+    if width <= 9:
+        rows = ["".join(str(value) for value in values[i:i + width])
+                for i in range(0, len(values), width)]
+    else:
+        rows = [" ".join(str(value) for value in values[i:i + width])
+                for i in range(0, len(values), width)]
+    return "{} {:02d}\n".format(solution.PREFIX, number) + \
+        "\n".join(rows) + "\n"
+
+
+def run():
+    ''' run:
+    Writes `Options.boards` boards with a unique solution to stdout, in the
+    `Grid NN` format that `solution.py` reads.
+    '''
+    numbers = xrange(Options.start, Options.start + Options.boards)
+    pool = None
+    if Options.jobs == 1:
+        boards = (generate(number) for number in numbers)
+    else:
+        pool = Pool(Options.jobs if Options.jobs > 0 else None)
+        boards = pool.imap(generate, numbers, 16)
+
+    for (number, board) in izip(numbers, boards):
+        if board is None:
+            sys.exit("no {} board with {} clues in {} tries for {}".format(
+                Options.difficulty, Options.clues, Options.tries, number))
+        sys.stdout.write(board)
+
+    if pool:
+        pool.close()
+        pool.join()
+
+
+if __name__ == "__main__":
+    nxt = None
+    if len(sys.argv) > 1:
+        def pboards(x): Options.boards = int(x)
+        def pclues(x): Options.clues = int(x)
+        def pdifficulty(x): Options.difficulty = x
+        def pjobs(x): Options.jobs = int(x)
+        def pseed(x): Options.seed = int(x)
+        def psize(x): Options.size = int(x)
+        def pstart(x): Options.start = int(x)
+        def ptries(x): Options.tries = int(x)
+        for arg in sys.argv[1:]:
+            if arg.startswith('-'):
+                nxt = None
+                if arg in ['-b', '--boards']:
+                    nxt = pboards
+                elif arg in ['-c', '--clues']:
+                    nxt = pclues
+                elif arg in ['-d', '--difficulty']:
+                    nxt = pdifficulty
+                elif arg in ['-j', '--jobs']:
+                    nxt = pjobs
+                elif arg in ['--seed']:
+                    nxt = pseed
+                elif arg in ['-n', '--size']:
+                    nxt = psize
+                elif arg in ['--start']:
+                    nxt = pstart
+                elif arg in ['--tries']:
+                    nxt = ptries
+            elif nxt:
+                nxt(arg)
+                nxt = None
+
+    run()
@@ -1,7 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: latin-1 -*-
+import csv
+import json
+import os
+import sqlite3
 import sys
+import time
+from array import array
+from itertools import chain, groupby, imap, islice, permutations
+from multiprocessing import Pool
+from string import maketrans
+numpy = None  # imported by load_numpy, only the batch engine needs it
 PREFIX = "Grid"
+BLANKS = maketrans(".", "0")
+CANONICAL_LIMIT = 256
+CACHE_BATCH = 1024
 
 
 class CollisionError(BaseException):
@@ -13,10 +26,24 @@ class NoPossibilityError(BaseException):
 
 
 class Options:
+    batch = 256
+    cache = None
+    cache_size = 100000
+    chunksize = 4
+    compact = False
     debug = False
+    engine = "propagate"
     euler = False
     fancy = False
     filename = "sudoku.txt"
+    jobs = 1
+    limit = 0
+    mode = "solve"
+    size = 3
+    stats = None
+    stats_format = "json"
+    strategies = []
+    window = 4096
 
 
 class NUMSET:
@@ -25,16 +52,497 @@ class NUMSET:
     SQUARE = 3
 
 
+class Stats:
+    ''' class Stats:
+    Counters for the work that went into solving a single puzzle.  A board
+    and all of its clones share the same Stats, the solver bumps the counters
+    as it goes and `solve_grid` fills in the rest.
+    '''
+    strategies = ["box_line", "naked_subsets", "hidden_subsets", "x_wing",
+                  "swordfish"]
+    fields = ["grid", "solved", "cached", "time", "clips", "exclusives",
+              "guesses", "backtracks", "depth"] + strategies
+
+    def __init__(self):
+        self.grid = ""
+        self.solved = False
+        self.cached = False
+        self.time = 0.0
+        self.clips = 0
+        self.exclusives = 0
+        self.guesses = 0
+        self.backtracks = 0
+        self.depth = 0
+        for strategy in self.strategies:
+            setattr(self, strategy, 0)
+
+    def guess(self, depth):
+        ''' (public) guess:
+        Counts a guess made at the given search depth.
+        '''
+        self.guesses += 1
+        if depth > self.depth:
+            self.depth = depth
+
+    def record(self):
+        ''' (public) record:
+        Returns the counters as a dict keyed by `fields`.
+        '''
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+
+class StatsLog:
+    ''' class StatsLog:
+    Writes the Stats record of each puzzle to the `--stats` file, as JSON lines
+    or CSV (`--stats-format`), and keeps enough of each to summarise the run.
+    '''
+    summary_fields = ["time", "clips", "exclusives", "guesses", "backtracks",
+                      "depth"]
+
+    def __init__(self, filename, fmt):
+        self.fp = open(filename, 'w')
+        self.format = fmt
+        self.values = dict((field, []) for field in self.summary_fields)
+        self.hits = dict((strategy, [0, 0]) for strategy in Stats.strategies)
+        self.slowest = None
+        if self.format == "csv":
+            self.writer = csv.DictWriter(self.fp, Stats.fields)
+            self.writer.writeheader()
+
+    def add(self, record):
+        ''' (public) add:
+        Writes out the record for a puzzle.
+        '''
+        if self.format == "csv":
+            self.writer.writerow(record)
+        else:
+            self.fp.write(json.dumps(record, sort_keys=True) + "\n")
+        for field in self.summary_fields:
+            self.values[field].append(record[field])
+        for strategy in Stats.strategies:
+            if record[strategy]:
+                self.hits[strategy][0] += record[strategy]
+                self.hits[strategy][1] += 1
+        if not self.slowest or record["time"] > self.slowest["time"]:
+            self.slowest = record
+
+    def summary(self):
+        ''' (public) summary:
+        Returns the lines of the run summary: the totals and the 50th, 90th and
+        99th percentiles and max of each counter, then the hits of each of the
+        strategies (and on how many of the boards).
+        '''
+        times = self.values["time"]
+        lines = ["stats: {} puzzles in {:.3f}s".format(len(times), sum(times))]
+        if not times:
+            return lines
+        for field in self.summary_fields:
+            values = sorted(self.values[field])
+            scale = 1000 if field == "time" else 1
+            line = "  {:<12}".format(
+                field + " (ms)" if field == "time" else field) + "".join(
+                "{:>5} {:<10.4g}".format(name, percentile(values, pct) * scale)
+                for (name, pct) in [("p50", 50), ("p90", 90), ("p99", 99),
+                                    ("max", 100)])
+            lines.append(line.rstrip())
+        lines.append("  slowest: {} ({:.2f}ms)".format(
+            self.slowest["grid"], self.slowest["time"] * 1000))
+        lines.append("  strategy hits: " + ", ".join(
+            "{} {} ({} boards)".format(strategy, *self.hits[strategy])
+            for strategy in Stats.strategies))
+        return lines
+
+    def close(self):
+        ''' (public) close:
+        Closes the stats file.
+        '''
+        self.fp.close()
+
+
+def percentile(values, pct):
+    ''' percentile:
+    Nearest rank percentile of an already sorted list of values.
+    '''
+    rank = int(len(values) * pct / 100.0 + 0.999999)
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+SYMBOLS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+class PopCount:
+    ''' class PopCount:
+    Stands in for the popcount lookup list on boards too wide for a table.
+    '''
+    def __getitem__(self, mask):
+        return bin(mask).count('1')
+
+
+class Geometry:
+    ''' class Geometry:
+    Lookup tables for a board of `size` x `size` squares, so `width` numbers in
+    each of the `width` rows, columns and squares.  These are built once per
+    size and shared by all of the boards of that size (see `geometry`).  Cells
+    are indexed row major, candidates are `width`-bit masks with bit `n - 1`
+    standing for the number `n` and units are numbered rows, then columns,
+    then squares.
+    '''
+    def __init__(self, size):
+        width = size * size
+        self.size = size
+        self.width = width
+        self.cells = width * width
+        self.numbers = range(1, width + 1)
+        self.all_bits = (1 << width) - 1
+        self.bits = [1 << (number - 1) for number in self.numbers]
+        self.values = dict((1 << (number - 1), number)
+                           for number in self.numbers)
+        if width <= 16:
+            self.typecode = 'H'
+            self.popcount = [bin(mask).count('1')
+                             for mask in range(self.all_bits + 1)]
+        else:
+            self.typecode = 'L'
+            self.popcount = PopCount()
+
+        self.rows = [cell / width for cell in range(self.cells)]
+        self.columns = [cell % width for cell in range(self.cells)]
+        self.squares = [self.rows[cell] / size * size + self.columns[cell] /
+                        size for cell in range(self.cells)]
+        self.units = [[] for unit in range(3 * width)]
+        self.unit_types = [NUMSET.ROW] * width + [NUMSET.COLUMN] * width + \
+            [NUMSET.SQUARE] * width
+        self.cell_units = []
+        for cell in range(self.cells):
+            units = [self.rows[cell], width + self.columns[cell],
+                     2 * width + self.squares[cell]]
+            for unit in units:
+                self.units[unit].append(cell)
+            self.cell_units.append(units)
+        self.peers = [tuple(sorted(set(sum([self.units[unit] for unit in
+                      self.cell_units[cell]], [])) - set([cell])))
+                      for cell in range(self.cells)]
+
+        # Exact cover matrix for the dlx engine.  Each candidate (cell * width
+        # + number - 1) covers 4 constraints: its cell is filled, and its row,
+        # column and square each have the number.
+        self.dlx_rows = []
+        self.dlx_columns = [[] for constraint in range(4 * self.cells)]
+        for candidate in range(self.cells * width):
+            cell, number = candidate / width, candidate % width
+            self.dlx_rows.append((
+                cell, self.cells + self.rows[cell] * width + number,
+                2 * self.cells + self.columns[cell] * width + number,
+                3 * self.cells + self.squares[cell] * width + number))
+            for constraint in self.dlx_rows[candidate]:
+                self.dlx_columns[constraint].append(candidate)
+
+        cells = " ".join(["{}"] * size)
+        self.normal_lines = [" " + " | ".join([cells] * size) + " \n"]
+        self.normal_lines += [" " + self.normal_lines[0][1:-2].replace(
+            "{}", "-").replace(" ", "-").replace("|", "+") + " \n", ""]
+        cells = "│".join(["{}"] * size)
+        self.fancy_lines = [" " + "┃".join([cells] * size) + " \n"]
+        for (line, cross, box) in [("━", "┿", "╋"), ("─", "┼", "╂")]:
+            self.fancy_lines.append(" " + self.fancy_lines[0][1:-2].replace(
+                "{}", line).replace("│", cross).replace("┃", box) + " \n")
+
+    def format(self, values):
+        ''' (public) format:
+        Lays out the printed values of each cell as a board, useful for
+        debugging purposes.
+        '''
+        lines = self.fancy_lines if Options.fancy else self.normal_lines
+        width = self.width
+        output = ""
+        for i in range(width):
+            output += lines[0].format(*values[(i * width):(i * width + width)])
+            if i < width - 1 and i % self.size == self.size - 1:
+                output += lines[1]
+            elif i < width - 1:
+                output += lines[2]
+
+        output += "\n"
+
+        return output
+
+
+GEOMETRIES = {}
+
+
+def geometry(size):
+    ''' geometry:
+    Returns the shared Geometry for boards with `size` x `size` squares.
+    '''
+    if size not in GEOMETRIES:
+        GEOMETRIES[size] = Geometry(size)
+
+    return GEOMETRIES[size]
+
+
+def parse_row(text, width):
+    ''' parse_row:
+    Returns the numbers (0 for blanks) in a line of text for a row of a board
+    `width` cells wide.  Rows either have a symbol for each cell (see
+    `SYMBOLS`, with `.` or `0` for blanks, anything else is skipped) or, for
+    the boards wider than 9, whitespace separated numbers.
+    '''
+    tokens = text.split()
+    if width > 9 and len(tokens) == width:
+        return [0 if token == '.' else int(token) for token in tokens]
+
+    values = []
+    for char in text.upper():
+        value = 0 if char == '.' else SYMBOLS.find(char)
+        if 0 <= value <= width:
+            values.append(value)
+
+    return values
+
+
+def canonical(values, size):
+    ''' canonical:
+    Returns the canonical key of a board, the same for every board that is a
+    symmetry of it (transposed, rows swapped within a band, bands swapped,
+    likewise for columns and stacks, and the numbers relabelled), along with
+    the symmetry that takes the board to the key (see `orient`).
+
+    The rows (and columns) are sorted by an invariant signature, the number of
+    clues in them and in the lines that cross them, and only the orders that
+    keep the ties in the signatures are tried (up to `CANONICAL_LIMIT` of them
+    for each orientation).  Of those, the smallest board after relabelling the
+    numbers in the order they are first read is the key.  When the limit cuts
+    the orders short the key may not be the same across all symmetries, which
+    only costs a cache miss.
+    '''
+    width = size * size
+    best = None
+    for transposed in [False, True]:
+        if transposed:
+            grid = [values[column::width] for column in range(width)]
+        else:
+            grid = [values[row * width:row * width + width]
+                    for row in range(width)]
+        row_orders = line_orders(line_keys(grid), size)
+        column_orders = list(islice(line_orders(line_keys(zip(*grid)), size),
+                                    CANONICAL_LIMIT))
+        tried = 0
+        for rows in row_orders:
+            for columns in column_orders:
+                labels = {0: 0}
+                key = []
+                smaller = best is None
+                for row in rows:
+                    line = grid[row]
+                    for column in columns:
+                        value = line[column]
+                        if value not in labels:
+                            labels[value] = len(labels)
+                        key.append(labels[value])
+                    if not smaller:
+                        # stop as soon as this order is bigger than the best
+                        order = cmp(key[-width:], best[0][len(key) - width:
+                                                            len(key)])
+                        if order > 0:
+                            break
+                        smaller = order < 0
+                else:
+                    if smaller:
+                        best = (key, (transposed, rows, columns, labels))
+                tried += 1
+                if tried >= CANONICAL_LIMIT:
+                    break
+            if tried >= CANONICAL_LIMIT:
+                break
+
+    key, symmetry = best
+    labels = symmetry[3]
+    for number in range(1, width + 1):
+        if number not in labels:
+            labels[number] = len(labels)
+
+    return "".join(SYMBOLS[value] for value in key), symmetry
+
+
+def line_keys(lines):
+    ''' line_keys:
+    Signature of each line (row or column) of a board that no symmetry keeping
+    the line a line changes: its clue count and the clue counts of the lines
+    crossing it at its clues.
+    '''
+    crossing = [len(line) - line.count(0) for line in zip(*lines)]
+    return [(len(line) - line.count(0),
+             sorted(crossing[i] for (i, value) in enumerate(line) if value))
+            for line in lines]
+
+
+def line_orders(keys, size):
+    ''' line_orders:
+    Generator over the orders of the lines with the given signatures, bands of
+    `size` lines sorted by their lines' signatures, then the lines sorted
+    within each band.  Each of the ways of ordering lines (or bands) with the
+    same signature is yielded.
+    '''
+    bands = [range(band * size, band * size + size) for band in range(size)]
+    band_keys = [sorted(keys[line] for line in band) for band in bands]
+
+    def orders(band_order):
+        if not band_order:
+            yield []
+            return
+        for lines in tied_orders(bands[band_order[0]], keys.__getitem__):
+            for rest in orders(band_order[1:]):
+                yield lines + rest
+
+    for band_order in tied_orders(range(size), band_keys.__getitem__):
+        for lines in orders(band_order):
+            yield lines
+
+
+def tied_orders(items, key):
+    ''' tied_orders:
+    Generator over the orders of the items sorted by `key`, with each of the
+    permutations of the runs of items with equal keys.
+    '''
+    runs = [list(run) for (value, run) in groupby(sorted(items, key=key), key)]
+
+    def orders(runs):
+        if not runs:
+            yield []
+            return
+        for run in permutations(runs[0]):
+            for rest in orders(runs[1:]):
+                yield list(run) + rest
+
+    return orders(runs)
+
+
+def orient(values, size, symmetry):
+    ''' orient:
+    Applies the symmetry from `canonical` to the values of a board.
+    '''
+    width = size * size
+    transposed, rows, columns, labels = symmetry
+    if transposed:
+        return [labels[values[column * width + row]]
+                for row in rows for column in columns]
+    return [labels[values[row * width + column]]
+            for row in rows for column in columns]
+
+
+def unorient(values, size, symmetry):
+    ''' unorient:
+    Undoes the symmetry from `canonical` on the values of a board, so takes a
+    canonical board back to the orientation of the original.
+    '''
+    width = size * size
+    transposed, rows, columns, labels = symmetry
+    numbers = dict((label, number) for (number, label) in labels.items())
+    original = [0] * (width * width)
+    for (i, row) in enumerate(rows):
+        for (j, column) in enumerate(columns):
+            cell = column * width + row if transposed else row * width + column
+            original[cell] = numbers[values[i * width + j]]
+
+    return original
+
+
+class ResultCache:
+    ''' class ResultCache:
+    On disk cache (`--cache FILE`) of solved boards, an sqlite table from the
+    canonical key of a board to its solution in the same orientation, so a
+    board seen before as any of its symmetries skips the solver.  Holds at
+    most `size` boards, the least recently used ones are evicted when the
+    changes are committed, every `CACHE_BATCH` changes and on close.
+    '''
+    def __init__(self, filename, size):
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS solutions "
+                        "(key TEXT PRIMARY KEY, solution TEXT, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS solutions_used "
+                        "ON solutions (used)")
+        self.size = size
+        self.changes = 0
+
+    def get(self, key):
+        ''' (public) get:
+        Returns the cached solution for the canonical key, or None.
+        '''
+        row = self.db.execute("SELECT solution FROM solutions WHERE key = ?",
+                              (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, solution):
+        ''' (public) put:
+        Caches the solution for the canonical key.
+        '''
+        self.db.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)",
+                        (key, solution, time.time()))
+        self.changed()
+
+    def touch(self, key):
+        ''' (public) touch:
+        Marks the cached solution for the key as just used.
+        '''
+        self.db.execute("UPDATE solutions SET used = ? WHERE key = ?",
+                        (time.time(), key))
+        self.changed()
+
+    def changed(self):
+        ''' (public) changed:
+        Counts a change, committing them once there are `CACHE_BATCH`.
+        '''
+        self.changes += 1
+        if self.changes >= CACHE_BATCH:
+            self.commit()
+
+    def commit(self):
+        ''' (public) commit:
+        Evicts the least recently used boards past the size of the cache and
+        commits the changes.
+        '''
+        self.db.execute("DELETE FROM solutions WHERE key IN (SELECT key FROM "
+                        "solutions ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                        (self.size,))
+        self.db.commit()
+        self.changes = 0
+
+    def close(self):
+        ''' (public) close:
+        Commits any changes and closes the cache.
+        '''
+        self.commit()
+        self.db.close()
+
+
+CACHES = {}
+
+
+def result_cache():
+    ''' result_cache:
+    Returns the ResultCache for `Options.cache`, opened once per process so
+    the pool workers each have their own connection.
+    '''
+    pid = os.getpid()
+    if pid not in CACHES:
+        CACHES[pid] = ResultCache(Options.cache, Options.cache_size)
+
+    return CACHES[pid]
+
+
 class NumSet:
     ''' class NumSet:
     Wrapper class for a "number set" which is defined as either a 3x3 square,
     a row, or a column in the Sudoku board.  This means that the nodes that
-    belong to it should each have one of each number between 1 and 9.
+    belong to it should each have one of each number between 1 and 9 (or the
+    board's width, for the bigger boards).
     '''
     def __init__(self, set_type):
         self.nodes = []
         self.answers = set()
         self.set_type = set_type
+        self.dirty = False
 
     def exclusives(self):
         ''' (public) exclusives:
@@ -45,7 +553,7 @@ class NumSet:
         '''
         # Find nodes that have the only occurance of the number
         possibility_count = {}
-        for i in range(1, 10):
+        for i in range(1, len(self.nodes) + 1):
             if i not in self.answers:
                 possibility_count[i] = []
 
@@ -58,8 +566,7 @@ class NumSet:
                     prune.append(possibility)
                     continue
                 possibility_count[possibility].append(node)
-            for number in prune:
-                node.possibilities.remove(number)
+            node.remove_possibilities(set(prune))
         # Loop over possibility counts
         found = 0
         for (number, nodes) in possibility_count.items():
@@ -72,7 +579,7 @@ class NumSet:
             # Look for nodes in both a square and row/column that exclusively
             # share a possibility clean out of other NumSet
             elif self.set_type == NUMSET.SQUARE and \
-                    (len(nodes) == 2 or len(nodes) == 3):
+                    1 < len(nodes) <= nodes[0].board.size:
                 # Row cleaning
                 rows = set([node.row_index for node in nodes])
                 if len(rows) == 1:
@@ -80,7 +587,7 @@ class NumSet:
                             if numset.set_type == NUMSET.ROW][0]
                     for node in row.nodes:
                         if node not in nodes:
-                            node.possibilities.discard(number)
+                            node.remove_possibilities(set([number]))
                 # Column cleaning
                 columns = set([node.column_index for node in nodes])
                 if len(columns) == 1:
@@ -88,17 +595,17 @@ class NumSet:
                             if numset.set_type == NUMSET.COLUMN][0]
                     for node in column.nodes:
                         if node not in nodes:
-                            node.possibilities.discard(number)
-            # TODO: this **really** could be cleaned up
+                            node.remove_possibilities(set([number]))
+            # anything smarter is left to the STRATEGIES (see `deduce`)
 
         # Find nodes that share identical possibility sets, if the length of
         # the shared set equals the length of the nodes, those possibilities
         # are exclusive to the set of nodes
         shares = []
-        for i in range(9):
+        for i in range(len(self.nodes)):
             base_node = self.nodes[i]
             match_set = []
-            for j in range(i + 1, 9):
+            for j in range(i + 1, len(self.nodes)):
                 if base_node.possibilities == self.nodes[j].possibilities:
                     match_set.append(self.nodes[j])
 
@@ -112,7 +619,7 @@ class NumSet:
 
             for node in self.nodes:
                 if node not in share_set and not node.is_solved():
-                    node.possibilities -= share_set[0].possibilities
+                    node.remove_possibilities(share_set[0].possibilities)
 
         return found
 
@@ -129,10 +636,11 @@ class Node:
         self.answer = answer
         self.row_index = row
         self.column_index = column
-        self.square_index = (column / 3 + 3 * (row / 3))
+        self.square_index = (column / board.size +
+                             board.size * (row / board.size))
         self.numsets = []
         self.possibilities = set()
-        self.possibilities = set(range(1, 10))
+        self.possibilities = set(range(1, board.width + 1))
         self.board = board
 
     def attach_numset(self, numset):
@@ -156,32 +664,28 @@ class Node:
         self.answer = answer
         self.possibilities = set()
         self.board.solved += 1
+        self.board.queue.append(self)
+        self.board.mark(self.numsets)
         for numset in self.numsets:
             if self.answer in numset.answers:
                 raise CollisionError(self.answer)
             numset.answers.add(self.answer)
 
-    def clip(self):
-        ''' (public) clip:
-        Goes through the already answered values for each of this Node's
-        NumSets and eliminates those from its possibilities pool.  If the set
-        is only 1 item, this should be the answer for the square.  This then
-        gets set as the answer.
-
-        Returns whether this clip call solved the Node and the number of
-        possibilities clipped
+    def remove_possibilities(self, numbers):
+        ''' (public) remove_possibilities:
+        Removes the `numbers` from the possibilities of an unanswered Node,
+        flagging its NumSets to be looked at again if any were removed.  If
+        only one possibility is left it gets set as the answer.
         '''
-        orig_len = len(self.possibilities)
-        for numset in self.numsets:
-            self.possibilities = self.possibilities - numset.answers
-
+        if self.is_solved() or not self.possibilities & numbers:
+            return
+        self.possibilities = self.possibilities - numbers
+        self.board.mark(self.numsets)
         if len(self.possibilities) == 1:
             self.set_answer(self.possibilities.pop())
         elif len(self.possibilities) == 0:
             raise NoPossibilityError
 
-        return self.is_solved(), orig_len - len(self.possibilities)
-
     def __str__(self, verbose=False):
         ''' (magic) __str__:
         Print output of the node, if the method is called with a verbose
@@ -189,7 +693,7 @@ class Node:
         node or the answer
         '''
         if not verbose:
-            return str(self.answer) if self.is_solved() else " "
+            return SYMBOLS[self.answer] if self.is_solved() else " "
         else:
             return "Answer: {answer} ({possibilities})".format(**self)
 
@@ -198,30 +702,28 @@ class Board:
     ''' class Board:
     Large wrapper class to encapsulate the basics of a board.  Using an object
     approach to gather the various operators on the board into a common
-    namespace.
-    '''
-    normal_lines = [
-        " {} {} {} | {} {} {} | {} {} {} \n",
-        " ------+-------+------ \n",
-        ""
-            ]
-    fancy_lines = [
-        " {}│{}│{}┃{}│{}│{}┃{}│{}│{} \n",
-        " ━┿━┿━╋━┿━┿━╋━┿━┿━ \n",
-        " ─┼─┼─╂─┼─┼─╂─┼─┼─ \n"
-            ]
-    def __init__(self):
+    namespace.  The `size` is the width of the squares, so the usual 9x9 board
+    is size 3.
+    '''
+    def __init__(self, size=3):
+        self.size = size
+        self.width = size * size
+        self.geometry = geometry(size)
         self.squares = []
         self.columns = []
         self.rows = []
         self.nodes = []
         self.numsets = []
         self.solved = 0
+        self.queue = []
+        self.dirty = []
+        self.stats = Stats()
 
-        for i in range(9):
+        for i in range(self.width):
             self.squares.append(self.__make_numset(NUMSET.SQUARE))
             self.columns.append(self.__make_numset(NUMSET.COLUMN))
             self.rows.append(self.__make_numset(NUMSET.ROW))
+        self.mark(self.numsets)
 
     def __make_numset(self, set_type):
         ''' (private) __make_numset:
@@ -232,6 +734,15 @@ class Board:
         self.numsets.append(numset)
         return numset
 
+    def mark(self, numsets):
+        ''' (public) mark:
+        Flags the NumSets as changed, queueing them up for `exclusives`.
+        '''
+        for numset in numsets:
+            if not numset.dirty:
+                numset.dirty = True
+                self.dirty.append(numset)
+
     def load_row(self, row_text, row):
         ''' (public) load_row:
         Takes a string of text that represents a row of the board, creating
@@ -239,10 +750,8 @@ class Board:
         column, and square).
         '''
         column = 0
-        for num in row_text:
-            if num < '0' or num > '9':
-                continue
-            self.build_node(int(num), row, column)
+        for num in parse_row(row_text, self.width):
+            self.build_node(num, row, column)
             column += 1
 
     def build_node(self, val, row, col):
@@ -261,32 +770,23 @@ class Board:
 
         return node
 
-    def clip(self):
-        ''' (public) clip:
-        Method that loops over each node and trims or clips down the
-        possibility list for each node (the possibility list is a list of all
-        of the potential values the node can have).  Returns the number of
-        nodes that had possibilities that could be clipped.
-        '''
-        solved_orig = self.solved
-        for node in self.nodes:
-            if node.is_solved():
-                continue
-            solved, changed = node.clip()
-
-        return self.solved - solved_orig
-
     def full_clip(self):
         ''' (public) full_clip:
-        Runs the `clip` optimization method until the node possiblities sets
-        can no longer be optimized/clipped.  This means finding every Node
-        that, by process of elimination, only has one possibility and answering
-        it, then looping through again to update other, related, nodes against
-        this new elimination.
+        Clips the Nodes until the node possiblities sets can no longer be
+        optimized/clipped.  This means finding every Node that, by process of
+        elimination, only has one possibility and answering it, then updating
+        the other, related, nodes against this new elimination.  Only the
+        NumSets of the Nodes answered since the last call (the `queue`) get
+        looked at, rather than every Node on the board.
         '''
-        clip = 1
-        while clip:
-            clip = self.clip()
+        self.stats.clips += 1
+        while self.queue:
+            node = self.queue.pop()
+            answer = set([node.answer])
+            for numset in node.numsets:
+                for peer in numset.nodes:
+                    if node.answer in peer.possibilities:
+                        peer.remove_possibilities(answer)
 
     def exclusives(self):
         ''' (public) exclusives:
@@ -295,28 +795,111 @@ class Board:
         if a Node has a possibility that is unique to the unanswered Nodes in
         a NumSet, it, by process of elimination, must be the answer (otherwise
         the NumSet would not ever have that as an answer).  A `full_clip` is
-        run after if an exclusive was found to optimize the possibilities for
-        all of the other squares.
+        run after to optimize the possibilities for all of the other squares.
+        Only the NumSets that changed since they were last looked at (the
+        `dirty` ones) are run.
         '''
+        self.stats.exclusives += 1
         exc = 0
-        for numset in self.numsets:
+        numsets, self.dirty = self.dirty, []
+        for numset in numsets:
+            numset.dirty = False
+        for numset in numsets:
             exc += numset.exclusives()
-        if exc:
-            self.full_clip()
+        self.full_clip()
 
         return exc
 
+    def is_complete(self):
+        ''' (public) is_complete:
+        Returns True/False whether every Node has been answered
+        '''
+        return self.solved == len(self.nodes)
+
+    def values(self):
+        ''' (public) values:
+        Returns the answer of each Node, 0 for the unanswered ones.
+        '''
+        return [node.answer for node in self.nodes]
+
+    def guess_cell(self):
+        ''' (public) guess_cell:
+        Returns the index of the unanswered Node with the smallest possibility
+        pool, or None if every Node is answered.  Raises a NoPossibilityError
+        if a Node has run out of possibilities.
+        '''
+        guess_index = None
+        possibility_count = self.width + 1
+        for i in range(len(self.nodes)):
+            node = self.nodes[i]
+            if not node.is_solved() \
+                    and len(node.possibilities) < possibility_count:
+                guess_index = i
+                possibility_count = len(node.possibilities)
+                if possibility_count == 0:
+                    raise NoPossibilityError
+
+        return guess_index
+
+    def possibilities(self, index):
+        ''' (public) possibilities:
+        Returns the sorted possibilities for the Node at `index`.
+        '''
+        return sorted(self.nodes[index].possibilities)
+
+    def set_answer(self, index, answer):
+        ''' (public) set_answer:
+        Sets the answer for the Node at `index`.
+        '''
+        self.nodes[index].set_answer(answer)
+
+    def remove_possibility(self, index, possibility):
+        ''' (public) remove_possibility:
+        Removes a single possibility from the Node at `index`.
+        '''
+        self.nodes[index].remove_possibilities(set([possibility]))
+
+    def masks(self):
+        ''' (public) masks:
+        Returns the candidates of each Node as a mask (see Geometry), the
+        answer's bit for the answered ones.
+        '''
+        bits = self.geometry.bits
+        return [bits[node.answer - 1] if node.answer else
+                sum(bits[number - 1] for number in node.possibilities)
+                for node in self.nodes]
+
+    def discard(self, index, mask):
+        ''' (public) discard:
+        Removes the possibilities in `mask` from the Node at `index`.
+        '''
+        bits = self.geometry.bits
+        self.nodes[index].remove_possibilities(set(
+            number for number in self.geometry.numbers
+            if mask & bits[number - 1]))
+
     def clone(self):
         ''' (public) clone:
         Performs an optimized deep copy of the Board.  It needs to be optimized
         because the Nodes hold circular references with their NumSets.
         '''
-        clone = Board()
+        clone = Board(self.size)
         for node in self.nodes:
             node_ = clone.build_node(node.answer, node.row_index,
                                      node.column_index)
             node_.possibilities = node.possibilities.copy()
 
+        # Building the nodes queued up everything, only carry over what was
+        # still waiting on this board
+        for numset in clone.numsets:
+            numset.dirty = False
+        clone.dirty = []
+        clone.mark([clone.numsets[self.numsets.index(numset)]
+                    for numset in self.dirty])
+        clone.queue = [clone.nodes[node.row_index * self.width +
+                                   node.column_index] for node in self.queue]
+        clone.stats = self.stats
+
         return clone
 
     def get_euler(self):
@@ -332,71 +915,698 @@ class Board:
         ''' (magic) __str__:
         Prints a representation of the Board, useful for debugging purposes.
         '''
-        lines = self.fancy_lines if Options.fancy else self.normal_lines
-        output = ""
-        for i in range(9):
-            output += lines[0].format(*self.nodes[(i * 9):(i * 9 + 9)])
-            if i < 8 and i % 3 == 2:
-                output += lines[1]
-            elif i < 8:
-                output += lines[2]
+        return self.geometry.format(self.nodes)
 
-        output += "\n"
 
-        return output
+class CompactBoard:
+    ''' class CompactBoard:
+    Alternative to the Board that skips the Node/NumSet objects entirely.  The
+    board is a flat array of candidate bitmasks, one per cell, and a cell is
+    answered once its mask is down to a single bit.  The rows, columns and
+    squares are the tables of the shared Geometry, so cloning is just a copy
+    of the array.  Like the Board, answered cells wait on the `queue` for
+    `full_clip` and changed units on `dirty` for `exclusives`.
+    '''
+    def __init__(self, size=3, cells=None, solved=0):
+        self.size = size
+        self.width = size * size
+        self.geometry = geometry(size)
+        if cells is None:
+            cells = [self.geometry.all_bits] * self.geometry.cells
+        self.cells = array(self.geometry.typecode, cells)
+        self.solved = solved
+        self.trail = None
+        self.queue = []
+        self.dirty = range(3 * self.width)
+        self.flagged = [True] * (3 * self.width)
+        self.stats = Stats()
+
+    def load_row(self, row_text, row):
+        ''' (public) load_row:
+        Takes a string of text that represents a row of the board and answers
+        each of the cells with a value in it.
+        '''
+        column = 0
+        for num in parse_row(row_text, self.width):
+            if num:
+                self.set_answer(row * self.width + column, num)
+            column += 1
+
+    def is_solved(self, index):
+        ''' (public) is_solved:
+        Returns True/False whether the cell at `index` is answered
+        '''
+        return self.geometry.popcount[self.cells[index]] == 1
+
+    def is_complete(self):
+        ''' (public) is_complete:
+        Returns True/False whether every cell has been answered
+        '''
+        return self.solved == self.geometry.cells
+
+    def set_answer(self, index, answer):
+        ''' (public) set_answer:
+        Sets the answer for the cell at `index`, raising a CollisionError if
+        an answered peer already holds it.
+        '''
+        bit = self.geometry.bits[answer - 1]
+        cells = self.cells
+        for peer in self.geometry.peers[index]:
+            if cells[peer] == bit:
+                raise CollisionError(answer)
+        if self.geometry.popcount[cells[index]] != 1:
+            self.solved += 1
+        if self.trail is not None:
+            self.trail.append((index, cells[index]))
+        cells[index] = bit
+        self.queue.append(index)
+        self.mark(index)
+
+    def mark(self, index):
+        ''' (public) mark:
+        Flags the units of the cell at `index` as changed, queueing them up
+        for `exclusives`.
+        '''
+        flagged = self.flagged
+        for unit in self.geometry.cell_units[index]:
+            if not flagged[unit]:
+                flagged[unit] = True
+                self.dirty.append(unit)
+
+    def remove_possibility(self, index, possibility):
+        ''' (public) remove_possibility:
+        Removes a single possibility from the cell at `index`, answering it if
+        only one is left.
+        '''
+        self.narrow(index,
+                    self.cells[index] & ~self.geometry.bits[possibility - 1])
+
+    def masks(self):
+        ''' (public) masks:
+        Returns a copy of the candidate mask of each cell.
+        '''
+        return self.cells.tolist()
+
+    def discard(self, index, mask):
+        ''' (public) discard:
+        Removes the candidates in `mask` from the cell at `index`.
+        '''
+        if self.cells[index] & mask:
+            self.narrow(index, self.cells[index] & ~mask)
+
+    def narrow(self, index, mask):
+        ''' (public) narrow:
+        Replaces the candidates of the unanswered cell at `index` with `mask`,
+        raising a NoPossibilityError if none are left or a CollisionError if
+        it is answered with a number a peer already has.
+        '''
+        if not mask:
+            raise NoPossibilityError
+        cells = self.cells
+        if self.trail is not None:
+            self.trail.append((index, cells[index]))
+        cells[index] = mask
+        self.mark(index)
+        if self.geometry.popcount[mask] == 1:
+            for peer in self.geometry.peers[index]:
+                if cells[peer] == mask:
+                    raise CollisionError(self.geometry.values[mask])
+            self.solved += 1
+            self.queue.append(index)
+
+    def possibilities(self, index):
+        ''' (public) possibilities:
+        Returns the sorted possibilities for the cell at `index`.
+        '''
+        mask = self.cells[index]
+        bits = self.geometry.bits
+        return [number for number in self.geometry.numbers
+                if mask & bits[number - 1]]
+
+    def values(self):
+        ''' (public) values:
+        Returns the answer of each cell, 0 for the unanswered ones.
+        '''
+        values = self.geometry.values
+        return [values.get(mask, 0) for mask in self.cells]
+
+    def guess_cell(self):
+        ''' (public) guess_cell:
+        Returns the index of the unanswered cell with the fewest candidates,
+        or None if the board is full.
+        '''
+        popcount = self.geometry.popcount
+        guess_index = None
+        possibility_count = self.width + 1
+        for i in range(self.geometry.cells):
+            count = popcount[self.cells[i]]
+            if count == 0:
+                raise NoPossibilityError
+            if 1 < count < possibility_count:
+                guess_index = i
+                possibility_count = count
+
+        return guess_index
+
+    def full_clip(self):
+        ''' (public) full_clip:
+        Removes the answer of each queued cell from its peers, which can in
+        turn answer and queue up more cells, until the queue is empty (see
+        Board.full_clip).
+        '''
+        self.stats.clips += 1
+        peers = self.geometry.peers
+        cells = self.cells
+        queue = self.queue
+        while queue:
+            index = queue.pop()
+            bit = cells[index]
+            for peer in peers[index]:
+                if cells[peer] & bit:
+                    self.narrow(peer, cells[peer] & ~bit)
+
+    def unit_exclusives(self, unit):
+        ''' (public) unit_exclusives:
+        The NumSet.exclusives logic for a single unit: answers numbers that
+        only have one home in the unit, cleans a square's numbers that are
+        confined to one row/column out of the rest of that row/column and
+        clears shared possibility sets out of the other cells.
+        '''
+        geometry = self.geometry
+        popcount = geometry.popcount
+        cells = self.cells
+        indexes = geometry.units[unit]
+        # the answered numbers and the ones with one or more homes
+        answered = 0
+        seen = 0
+        twice = 0
+        for i in indexes:
+            mask = cells[i]
+            if popcount[mask] == 1:
+                answered |= mask
+            twice |= seen & mask
+            seen |= mask
+        if seen != geometry.all_bits:
+            raise NoPossibilityError
+        once = seen & ~twice & ~answered
+        square = geometry.unit_types[unit] == NUMSET.SQUARE
+
+        found = 0
+        for number in geometry.numbers:
+            bit = geometry.bits[number - 1]
+            if answered & bit or not (once & bit or square):
+                continue
+            homes = [i for i in indexes if cells[i] & bit]
+            if not homes:
+                raise NoPossibilityError
+            if len(homes) == 1:
+                self.set_answer(homes[0], number)
+                answered |= bit
+                found += 1
+            elif square and len(homes) <= self.size:
+                rows = set([geometry.rows[i] for i in homes])
+                columns = set([geometry.columns[i] for i in homes])
+                if len(rows) == 1:
+                    self.__discard(geometry.units[rows.pop()], homes, bit)
+                if len(columns) == 1:
+                    self.__discard(geometry.units[self.width + columns.pop()],
+                                   homes, bit)
+
+        shares = {}
+        for i in indexes:
+            if popcount[cells[i]] > 1:
+                shares.setdefault(cells[i], []).append(i)
+        for (mask, share_set) in shares.items():
+            if len(share_set) == popcount[mask]:
+                self.__discard(indexes, share_set, mask)
+
+        return found
+
+    def __discard(self, indexes, keep, mask):
+        ''' (private) __discard:
+        Removes the `mask` candidates from the unanswered cells in `indexes`
+        that are not in `keep`.
+        '''
+        popcount = self.geometry.popcount
+        cells = self.cells
+        for i in indexes:
+            if i in keep or popcount[cells[i]] == 1:
+                continue
+            if cells[i] & mask:
+                self.narrow(i, cells[i] & ~mask)
+
+    def exclusives(self):
+        ''' (public) exclusives:
+        Runs `unit_exclusives` over the dirty units, then `full_clip`s the
+        board (see Board.exclusives).
+        '''
+        self.stats.exclusives += 1
+        exc = 0
+        flagged = self.flagged
+        units, self.dirty = self.dirty, []
+        for unit in units:
+            flagged[unit] = False
+        for unit in units:
+            exc += self.unit_exclusives(unit)
+        self.full_clip()
+
+        return exc
+
+    def undo(self, mark, solved):
+        ''' (public) undo:
+        Unwinds the trail back to `mark` entries, restoring each changed cell,
+        and resets the solved count to what it was at that point.  Marks are
+        only taken once propagation is done, so nothing is left queued.
+        '''
+        cells = self.cells
+        trail = self.trail
+        while len(trail) > mark:
+            index, mask = trail.pop()
+            cells[index] = mask
+        self.solved = solved
+        self.queue = []
+        self.dirty = []
+        self.flagged = [False] * (3 * self.width)
+
+    def clone(self):
+        ''' (public) clone:
+        Copies the board, this is a single copy of the cell array (plus the
+        pending queue/dirty units).
+        '''
+        clone = CompactBoard(self.size, self.cells, self.solved)
+        clone.queue = self.queue[:]
+        clone.dirty = self.dirty[:]
+        clone.flagged = self.flagged[:]
+        clone.stats = self.stats
+        return clone
+
+    def get_euler(self):
+        ''' (public) get_euler:
+        Returns the 3 digit number made up of the first 3 cells (see
+        Board.get_euler).
+        '''
+        values = self.values()
+        return values[0] * 100 + values[1] * 10 + values[2]
+
+    def __str__(self):
+        ''' (magic) __str__:
+        Prints a representation of the board, useful for debugging purposes.
+        '''
+        return self.geometry.format([SYMBOLS[value] if value else " "
+                                     for value in self.values()])
 
 
 def load_file(filename):
     ''' load_file:
-    The given filename is read in against the standard used in the puzzle file.
-    Looping over each board in the file, the board is loaded and then attempted
-    to be solved.
-
-    file format example:
+    The given filename (`-` for stdin) is read in against the standard used in
+    the puzzle file.  Looping over each board in the file, the board is loaded
+    and then attempted to be solved.  With more than one job (`-j`), the
+    boards are handed out to a pool of worker processes, results still come
+    back in file order.  With `--cache FILE` the boards already solved (as
+    any of their symmetries) are looked up in the ResultCache instead.
+
+    file format examples (see `read_grids`):
         Grid X
         01000200003
         90000070000
         etc...
+
+        ..3.2.6..9..3.5..1..18.64....81.29..7.......8..67.82....26.95.. (...)
     '''
-    f = open(filename, 'r')
-    line = "~~"
+    if Options.engine == "batch" and load_numpy() is None:
+        sys.exit("the batch engine needs numpy")
+    f = sys.stdin if filename == '-' else open(filename, 'r')
     solved_cnt = 0
     euler = 0
-    while line:
-        line = f.readline()
-        if line.startswith(PREFIX):
-            board = load_board(f)
-            board = solve(board)
-            if board.solved == 81:
-                solved_cnt += 1
-                euler += board.get_euler()
-
-            if Options.debug:
-                print line
-                print board
-            else:
-                sys.stdout.write('%s' % '.' if board.solved == 81 else 'E')
-                sys.stdout.flush()
+    pool = None
+    grids = read_grids(f, Options.size)
+    if Options.engine == "batch":
+        batches = iter(lambda: list(islice(grids, Options.batch)), [])
+        if Options.jobs == 1:
+            results = imap(solve_batch, batches)
+        else:
+            pool = Pool(Options.jobs if Options.jobs > 0 else None)
+            results = pool_results(pool, batches, solve_batch,
+                                   max(1, Options.window / Options.batch))
+        results = chain.from_iterable(results)
+    elif Options.jobs == 1:
+        results = imap(solve_grid, grids)
+    else:
+        pool = Pool(Options.jobs if Options.jobs > 0 else None)
+        results = pool_results(pool, grids, solve_grid, Options.window)
+
+    log = StatsLog(Options.stats, Options.stats_format) \
+        if Options.stats else None
+    cached = 0
+    for (header, solved, value, output, record, entry) in results:
+        if solved:
+            solved_cnt += 1
+            euler += value
+        if log:
+            log.add(record)
+        if entry and entry[1] is None:
+            cached += 1
+            result_cache().touch(entry[0])
+        elif entry:
+            result_cache().put(*entry)
+
+        if Options.debug:
+            print header
+            print output
+        else:
+            sys.stdout.write('%s' % '.' if solved else 'E')
+            sys.stdout.flush()
+
+    if pool:
+        pool.close()
+        pool.join()
 
     if not Options.debug:
         sys.stdout.write('\n')
         sys.stdout.flush()
 
     print "solved " + str(solved_cnt) + " puzzles"
+    if Options.cache:
+        result_cache().close()
+        print str(cached) + " from the cache"
     if Options.euler:
         print "euler answer: " + str(euler)
+    if log:
+        log.close()
+        print "\n".join(log.summary())
+
+
+def read_grids(fp, size=3):
+    ''' read_grids:
+    Generator over the boards in an open puzzle file (or stdin), yields the
+    header line and the 9 lines of the board for each (`size` ** 2 lines for
+    the other board sizes, see `parse_row`).  Only the current board is held
+    in memory.  Two layouts are understood and can be mixed:
+    - the euler layout, a `Grid` header line followed by the 9 rows
+    - one board per line, 81 characters with `.` or `0` for the blanks, these
+      are given a `Grid` header from their position in the input
+    '''
+    width = size * size
+    count = 0
+    for line in fp:
+        if line.startswith(PREFIX):
+            count += 1
+            yield line, [next(fp) for i in range(width)]
+            continue
+        line = line.strip()
+        if len(line) != width * width:
+            continue
+        count += 1
+        line = line.translate(BLANKS)
+        yield "{} {:02d}\n".format(PREFIX, count), \
+            [line[i:i + width] for i in range(0, width * width, width)]
+
+
+def pool_results(pool, grids, solver, size):
+    ''' pool_results:
+    Runs the grids (or batches of grids) through the `solver` on the pool in
+    windows of `size`, so the pool never pulls more than a window of a large
+    input into memory.  Yields the results in input order.
+    '''
+    while True:
+        window = list(islice(grids, size))
+        if not window:
+            break
+        for result in pool.imap(solver, window, Options.chunksize):
+            yield result
+
+
+def solve_grid(grid):
+    ''' solve_grid:
+    Builds and solves the board for a (header, rows) pair from `read_grids`.
+    Returns the header, whether it was solved, its euler value, the printed
+    board (only when debugging), its Stats record and its cache entry, this is
+    what the worker processes send back.  The cache entry is the canonical key
+    and solution for the parent process to cache, with None for the solution
+    when the board came from the cache, or None when not caching.
+    '''
+    header, rows = grid
+    start = time.time()
+    entry = None
+    board = None
+    if Options.cache:
+        values = sum([parse_row(row, Options.size ** 2) for row in rows], [])
+        key, symmetry = canonical(values, Options.size)
+        found = result_cache().get(key)
+        if found:
+            board = cached_board(found, symmetry)
+            stats = board.stats
+            stats.cached = True
+            entry = (key, None)
+    if not board:
+        board, stats = solve_rows(rows)
+    stats.time = time.time() - start
+    stats.grid = header.strip()
+    stats.solved = solved = board is not None and board.is_complete()
+    if Options.cache and solved and not entry:
+        entry = cache_entry(board, key, symmetry)
+    return (header, solved, board.get_euler() if solved else 0,
+            board_text(board) if Options.debug else None, stats.record(),
+            entry)
+
+
+def solve_rows(rows, board=None):
+    ''' solve_rows:
+    Builds the board for the rows (unless it is given) and solves it,
+    returning the board and its Stats.  A board whose givens contradict each
+    other comes back as None instead of raising, the CollisionError and
+    NoPossibilityError are BaseExceptions that would kill a pool worker and
+    leave the pool waiting on its task forever.
+    '''
+    stats = board.stats if board else Stats()
+    try:
+        if board is None:
+            board = build_board(rows)
+            stats = board.stats
+        return solve(board), stats
+    except (CollisionError, NoPossibilityError):
+        return None, stats
+
+
+def board_text(board):
+    ''' board_text:
+    The printed board for debugging, or a note for an invalid one.
+    '''
+    return "invalid board" if board is None else str(board)
+
+
+def cache_entry(board, key, symmetry):
+    ''' cache_entry:
+    The cache entry for a solved board, its canonical key and its solution
+    with the symmetry applied.
+    '''
+    return (key, "".join(SYMBOLS[value] for value in
+                         orient(board.values(), Options.size, symmetry)))
 
 
-def load_board(fp):
-    ''' load_board:
-    Loads the board from the file, this assumes there are 9 lines of 9 numbers
-    each, each number represents a place on the board.  Returns the built
-    Board object.
+def cached_board(solution, symmetry):
+    ''' cached_board:
+    Builds the solved CompactBoard for a solution from the cache, undoing the
+    symmetry of the board it was looked up for.
+    '''
+    bits = geometry(Options.size).bits
+    values = unorient([SYMBOLS.index(char) for char in solution],
+                      Options.size, symmetry)
+    return CompactBoard(Options.size, [bits[value - 1] for value in values],
+                        len(values))
+
+
+def solve_batch(grids):
+    ''' solve_batch:
+    The `--engine batch` solver, takes a list of (header, rows) pairs from
+    `read_grids` and returns the `solve_grid` result for each.  The boards
+    are held as one numpy array of candidate masks, a row per board, and the
+    naked and hidden singles are found for all of them at once (see
+    `batch_propagate`).  The boards that are left unsolved go on to the usual
+    search as CompactBoards, boards that hit a contradiction are solved from
+    scratch so they fail the same way as with the other engines.  With
+    `--cache FILE` the boards found in the cache are left out of the batch
+    and the others give cache entries as in `solve_grid`.  The time of the
+    batch is split evenly over its boards in their Stats.
+    '''
+    start = time.time()
+    load_numpy()
+    tables = batch_tables(Options.size)
+    geo = tables.geometry
+    keys = [(None, None)] * len(grids)
+    found = [None] * len(grids)
+    if Options.cache:
+        for (i, (header, rows)) in enumerate(grids):
+            values = sum([parse_row(row, geo.width) for row in rows], [])
+            keys[i] = canonical(values, Options.size)
+            found[i] = result_cache().get(keys[i][0])
+    # the row in the batch of each board not found in the cache
+    batch = dict((i, row) for (row, i) in enumerate(
+        i for i in range(len(grids)) if not found[i]))
+    cells = numpy.empty((len(batch), geo.cells), tables.dtype)
+    for (i, row) in batch.items():
+        (header, rows) = grids[i]
+        text = "".join(row.strip() for row in rows)
+        if geo.width <= 9 and len(text) == geo.cells and text.isdigit():
+            values = numpy.frombuffer(text, numpy.uint8) - ord('0')
+        else:
+            values = sum([parse_row(line, geo.width) for line in rows], [])
+        cells[row] = tables.givens[values]
+
+    rounds, bad = batch_propagate(cells, tables)
+    solved = (tables.popcount(cells) == 1).sum(1)
+    share = (time.time() - start) / max(len(grids), 1)
+
+    results = []
+    for (i, (header, rows)) in enumerate(grids):
+        start = time.time()
+        (key, symmetry) = keys[i]
+        entry = None
+        if found[i]:
+            board = cached_board(found[i], symmetry)
+            board.stats.cached = True
+            entry = (key, None)
+        elif bad[batch[i]]:
+            board, stats = solve_rows(rows)
+        else:
+            row = batch[i]
+            board = CompactBoard(Options.size, cells[row].tolist(),
+                                 int(solved[row]))
+            board.stats.clips += int(rounds[row])
+            if not board.is_complete():
+                board, stats = solve_rows(rows, board)
+        stats = board.stats if board else stats
+        stats.time = share + time.time() - start
+        stats.grid = header.strip()
+        stats.solved = complete = board is not None and board.is_complete()
+        if Options.cache and complete and not entry:
+            entry = cache_entry(board, key, symmetry)
+        results.append((header, complete, board.get_euler() if complete else 0,
+                        board_text(board) if Options.debug else None,
+                        stats.record(), entry))
+
+    return results
+
+
+def batch_propagate(cells, tables):
+    ''' batch_propagate:
+    Narrows the candidate masks of a batch of boards (a row of `cells` each)
+    in place until none of them change, each round:
+    - the answered cells are removed from the candidates of their peers
+    - a number that fits in only one cell of a row/column/square answers it
+    Boards drop out of the rounds once they stop changing or hit a
+    contradiction (a cell with no candidates, two peers with the same answer
+    or a number with no place in a unit).  Returns the number of rounds each
+    board took and whether it hit a contradiction.
     '''
-    board = Board()
-    for i in range(9):
-        line = fp.readline()
-        board.load_row(line, i)
+    geo = tables.geometry
+    rounds = numpy.zeros(len(cells), numpy.int32)
+    bad = numpy.zeros(len(cells), bool)
+    active = numpy.arange(len(cells))
+    while active.size:
+        board = cells[active]
+        before = board.copy()
+
+        answered = numpy.where(tables.popcount(board) == 1, board, 0)
+        taken = numpy.bitwise_or.reduce(answered[:, tables.peers], axis=2)
+        broken = (answered & taken).any(1)
+        board = numpy.where(answered != 0, board, board & ~taken)
+
+        for units in tables.units:
+            masks = board[:, units]
+            once = numpy.zeros(masks.shape[:2], tables.dtype)
+            twice = numpy.zeros(masks.shape[:2], tables.dtype)
+            for k in range(geo.width):
+                twice |= once & masks[:, :, k]
+                once |= masks[:, :, k]
+            broken |= (once != geo.all_bits).any(1)
+            hidden = masks & (once & ~twice)[:, :, None]
+            board[:, units] = numpy.where(hidden != 0, hidden, masks)
+
+        broken |= (board == 0).any(1)
+        cells[active] = board
+        rounds[active] += 1
+        bad[active[broken]] = True
+        active = active[(board != before).any(1) & ~broken]
+
+    return rounds, bad
+
+
+class BatchTables:
+    ''' class BatchTables:
+    The Geometry lookups as numpy arrays for the batch engine: the peers of
+    each cell, the cells of the rows, columns and squares (a `width` x
+    `width` array for each, as each of them covers the board once), the
+    mask for each given number (0 for all of the candidates) and a popcount.
+    '''
+    def __init__(self, size):
+        geo = geometry(size)
+        self.geometry = geo
+        self.dtype = numpy.uint16 if geo.width <= 16 else numpy.uint32
+        self.peers = numpy.array(geo.peers, numpy.intp)
+        self.units = [numpy.array(geo.units[start:start + geo.width],
+                                  numpy.intp)
+                      for start in range(0, 3 * geo.width, geo.width)]
+        self.givens = numpy.array([geo.all_bits] + geo.bits, self.dtype)
+        if geo.width <= 16:
+            self.counts = numpy.array(geo.popcount, numpy.uint8)
+        else:
+            self.counts = None
+
+    def popcount(self, masks):
+        ''' (public) popcount:
+        Returns the number of candidates in each of the masks.
+        '''
+        if self.counts is not None:
+            return self.counts[masks]
+        masks = masks.astype(numpy.uint32)
+        masks = masks - ((masks >> 1) & 0x55555555)
+        masks = (masks & 0x33333333) + ((masks >> 2) & 0x33333333)
+        masks = (masks + (masks >> 4)) & 0x0F0F0F0F
+        return (masks * 0x01010101) >> 24
+
+
+BATCH_TABLES = {}
+
+
+def load_numpy():
+    ''' load_numpy:
+    Imports numpy the first time the batch engine needs it, so the other
+    engines don't carry it around.  Returns the module, or None when numpy
+    isn't installed.
+    '''
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+
+    return numpy
+
+
+def batch_tables(size):
+    ''' batch_tables:
+    Returns the shared BatchTables for boards with `size` x `size` squares.
+    '''
+    if size not in BATCH_TABLES:
+        load_numpy()
+        BATCH_TABLES[size] = BatchTables(size)
+
+    return BATCH_TABLES[size]
+
+
+def build_board(rows):
+    ''' build_board:
+    Builds a Board (or CompactBoard) of `Options.size` from the lines of text
+    for its rows.
+    '''
+    if Options.compact:
+        board = CompactBoard(Options.size)
+    else:
+        board = Board(Options.size)
+    for i in range(board.width):
+        board.load_row(rows[i], i)
 
     return board
 
@@ -416,77 +1626,556 @@ def solve(board):
       (or more) squares that share the same possibility set, making it
       exclusive for them (i.e. 2 nodes with (1, 2) means they HAVE to have
       either)
-    - If still not solved, will begin simulating boards based on a guess using
-      the `simulate_guess` function
+    - Once those run dry, the `--strategies` get a go (see `STRATEGIES`), any
+      progress goes back through the exclusives
+    - If still not solved, will begin guessing with the backtracking `search`
+    With `--engine dlx` the board goes to `dlx_solve` instead.
+    '''
+    if Options.engine == "dlx":
+        return dlx_solve(board)
+
+    deduce(board)
+
+    if not board.is_complete():
+        return search(board)
+
+    return board
+
+
+def deduce(board):
+    ''' deduce:
+    Everything short of guessing: clips the board and runs the exclusives
+    until they stop finding answers, then tries the strategies that are
+    turned on (`Options.strategies`) in order, going back to the exclusives
+    after the first that makes any progress.  Each strategy that does counts
+    a hit in the board's Stats.
     '''
     board.full_clip()
-    found = 1
-    while found:
-        found = board.exclusives()
+    while True:
+        found = 1
+        while found:
+            found = board.exclusives()
+        if board.is_complete():
+            return
+        for (name, strategy) in STRATEGIES:
+            if name in Options.strategies and strategy(board):
+                setattr(board.stats, name, getattr(board.stats, name) + 1)
+                break
+        else:
+            return
 
-    while board.solved < 81:
-        board = simulate_guess(board)
 
+def subsets(masks, size, popcount):
+    ''' subsets:
+    Generator over the groups of `size` of the masks (by their positions in
+    the list) that only cover `size` bits between them.  Groups are built up
+    a mask at a time and dropped as soon as they cover too many bits.
+    '''
+    def grow(start, group, union):
+        if len(group) == size:
+            if popcount[union] == size:
+                yield group, union
+            return
+        for i in range(start, len(masks) - size + len(group) + 1):
+            covered = union | masks[i]
+            if popcount[covered] <= size:
+                for found in grow(i + 1, group + [i], covered):
+                    yield found
+
+    return grow(0, [], 0)
+
+
+def homes(geometry, masks, indexes):
+    ''' homes:
+    For each of the numbers, the mask of the positions within `indexes` (bit
+    `i` for `indexes[i]`) of the cells that could hold it.  The answered cells
+    count too, the masks can be behind the board and a cell answered since
+    hasn't been clipped from its peers yet.
+    '''
+    found = [0] * geometry.width
+    for (position, index) in enumerate(indexes):
+        mask = masks[index]
+        for number in geometry.numbers:
+            if mask & geometry.bits[number - 1]:
+                found[number - 1] |= 1 << position
+
+    return found
+
+
+def naked_subsets(board):
+    ''' naked_subsets:
+    Strategy, `size` unanswered cells of a unit that only have `size`
+    candidates between them hold those numbers, so they are removed from the
+    rest of the unit.  Up to half the unanswered cells of the unit are tried,
+    a bigger naked subset is the other side of a smaller hidden subset (see
+    `hidden_subsets`).  Returns the number of cells narrowed.
+    '''
+    geometry = board.geometry
+    popcount = geometry.popcount
+    masks = board.masks()
+    narrowed = 0
+    for indexes in geometry.units:
+        open_cells = [index for index in indexes if popcount[masks[index]] > 1]
+        for size in range(2, len(open_cells) / 2 + 1):
+            small = [index for index in open_cells
+                     if popcount[masks[index]] <= size]
+            for (group, union) in subsets([masks[index] for index in small],
+                                          size, popcount):
+                group = [small[i] for i in group]
+                for index in open_cells:
+                    if index not in group and masks[index] & union:
+                        board.discard(index, union)
+                        narrowed += 1
+
+    return narrowed
+
+
+def hidden_subsets(board):
+    ''' hidden_subsets:
+    Strategy, `size` numbers that can only go in the same `size` cells of a
+    unit have those cells to themselves, so the other candidates of the cells
+    are removed.  Like `naked_subsets` up to half the unanswered cells of the
+    unit are tried.  Returns the number of cells narrowed.
+    '''
+    geometry = board.geometry
+    popcount = geometry.popcount
+    masks = board.masks()
+    narrowed = 0
+    for indexes in geometry.units:
+        places = homes(geometry, masks, indexes)
+        numbers = [number for number in geometry.numbers
+                   if popcount[places[number - 1]] > 1]
+        for size in range(2, len(numbers) / 2 + 1):
+            small = [number for number in numbers
+                     if popcount[places[number - 1]] <= size]
+            for (group, union) in subsets([places[number - 1]
+                                           for number in small],
+                                          size, popcount):
+                keep = sum(geometry.bits[small[i] - 1] for i in group)
+                for (position, index) in enumerate(indexes):
+                    if union & (1 << position) and masks[index] & ~keep:
+                        board.discard(index, masks[index] & ~keep)
+                        narrowed += 1
+
+    return narrowed
+
+
+def box_line(board):
+    ''' box_line:
+    Strategy, both ways between squares and lines (rows and columns):
+    - a number that can only go in one line of a square comes out of the
+      rest of that line (pointing)
+    - a number that can only go in one square along a line comes out of the
+      rest of that square (claiming)
+    Returns the number of cells narrowed.
+    '''
+    geometry = board.geometry
+    width = geometry.width
+    masks = board.masks()
+    narrowed = 0
+    for (unit, indexes) in enumerate(geometry.units):
+        places = homes(geometry, masks, indexes)
+        for number in geometry.numbers:
+            cells = [indexes[position] for position in range(width)
+                     if places[number - 1] & (1 << position)]
+            if len(cells) < 2:
+                continue
+            if geometry.unit_types[unit] == NUMSET.SQUARE:
+                targets = [geometry.units[line] for line in
+                           [geometry.rows[cells[0]],
+                            width + geometry.columns[cells[0]]]
+                           if all(cell in geometry.units[line]
+                                  for cell in cells)]
+            else:
+                square = 2 * width + geometry.squares[cells[0]]
+                targets = [geometry.units[square]] \
+                    if all(2 * width + geometry.squares[cell] == square
+                           for cell in cells) else []
+            bit = geometry.bits[number - 1]
+            for target in targets:
+                for index in target:
+                    if index not in cells and masks[index] & bit and \
+                            geometry.popcount[masks[index]] > 1:
+                        board.discard(index, bit)
+                        masks[index] &= ~bit
+                        narrowed += 1
+
+    return narrowed
+
+
+def fish(board, size):
+    ''' fish:
+    Strategy, for each number: when `size` rows only have the number's
+    candidates in the same `size` columns between them, those columns'
+    copies of the number have to be in those rows, so the number comes out
+    of the rest of the columns (and the same with the rows and columns
+    swapped).  An X-Wing is a fish of size 2, a Swordfish of size 3.
+    Returns the number of cells narrowed.
+    '''
+    geometry = board.geometry
+    popcount = geometry.popcount
+    width = geometry.width
+    masks = board.masks()
+    narrowed = 0
+    for (base, cover) in [(0, width), (width, 0)]:
+        lines = [homes(geometry, masks, geometry.units[base + line])
+                 for line in range(width)]
+        for number in geometry.numbers:
+            bit = geometry.bits[number - 1]
+            candidates = [line for line in range(width)
+                          if 2 <= popcount[lines[line][number - 1]] <= size]
+            for (group, union) in subsets([lines[line][number - 1]
+                                           for line in candidates],
+                                          size, popcount):
+                group = [candidates[i] for i in group]
+                for position in range(width):
+                    if not union & (1 << position):
+                        continue
+                    for (line, index) in enumerate(
+                            geometry.units[cover + position]):
+                        if line not in group and masks[index] & bit and \
+                                popcount[masks[index]] > 1:
+                            board.discard(index, bit)
+                            masks[index] &= ~bit
+                            narrowed += 1
+
+    return narrowed
+
+
+def x_wing(board):
+    ''' x_wing:
+    Strategy, the size 2 `fish`.
+    '''
+    return fish(board, 2)
+
+
+def swordfish(board):
+    ''' swordfish:
+    Strategy, the size 3 `fish`.
+    '''
+    return fish(board, 3)
+
+
+# The strategies `deduce` tries once the exclusives run dry, cheapest first.
+# Each takes a board and returns how many cells it narrowed, working from a
+# snapshot of the candidates (`masks`), which only get narrower, so what it
+# finds still holds as the board changes under it.
+STRATEGIES = [
+    ("box_line", box_line),
+    ("naked_subsets", naked_subsets),
+    ("hidden_subsets", hidden_subsets),
+    ("x_wing", x_wing),
+    ("swordfish", swordfish),
+]
+
+
+def search(board):
+    ''' search:
+    Backtracking search on a board (see `explore`).  Returns the board, solved
+    unless every guess failed.  A trail the CompactBoard already had is left
+    recording, otherwise it is dropped again.
+    '''
+    trailed = isinstance(board, CompactBoard) and board.trail is None
+    for board in explore(board):
+        break
+
+    if trailed:
+        board.trail = None
     return board
 
 
-def simulate_guess(board):
-    ''' simulate_guess:
-    Clones the passed in board.  Locates the node with the smallest possibility
-    pool, takes the first of those and sets the answer to be that.  Then
-    attempts to solve the board with this answer, if it fails, removes that
-    answer from the node's possibility set and returns the board.
-    '''
-    board_ = board.clone()
-
-    guess_node = None
-    node_index = 0
-    i = 0
-    possibility_count = 10
-    for node in board_.nodes:
-        if not node.is_solved() \
-                and len(node.possibilities) < possibility_count:
-            # This node is a better choice than previious
-            guess_node = node
-            node_index = i
-            possibility_count = len(node.possibilities)
-            if possibility_count == 0:
-                raise NoPossibilityError
-        i += 1
+def explore(board):
+    ''' explore:
+    Generator doing the backtracking search of a board.  A CompactBoard is
+    searched in place: every cell change is recorded on the board's trail; a
+    guess pushes the cell (the one with the fewest candidates), its remaining
+    candidates and the trail position onto an explicit stack, and a dead end
+    unwinds the trail to the top of the stack before trying the next
+    candidate.  A Board has no trail, so the stack holds a clone of it from
+    before the guess instead and a dead end carries on from a copy of that.
+    Yields the board each time it is solved, carrying on through the rest of
+    the search tree when resumed.  A CompactBoard that already has a trail
+    keeps it, the search only ever unwinds its own part of it.
+    '''
+    trailed = isinstance(board, CompactBoard)
+    owned = trailed and board.trail is None
+    if owned:
+        board.trail = []
+    stack = []
+    guess = None
+    while True:
+        try:
+            if guess:
+                board.set_answer(*guess)
+            deduce(board)
+            index = board.guess_cell()
+            if index is None:
+                yield board
+            else:
+                stack.append((index, board.possibilities(index),
+                              len(board.trail) if trailed else board.clone(),
+                              board.solved))
+        except (CollisionError, NoPossibilityError):
+            board.stats.backtracks += 1
+
+        while stack and not stack[-1][1]:
+            stack.pop()
+        if not stack:
+            break
+        index, guesses, mark, solved = stack[-1]
+        if trailed:
+            board.undo(mark, solved)
+        else:
+            board = mark.clone()
+        guess = (index, guesses.pop(0))
+        board.stats.guess(len(stack))
 
-    if not guess_node:
-        return None
+    if owned:
+        board.trail = None
 
-    # Grab the guess being made and set it on the node being used
-    guess = guess_node.possibilities.pop()
-    guess_node.set_answer(guess)
 
-    try:  # Attempt to solve the board with this guess
-        board_.full_clip()
-        found = 1
-        while found:
-            found = board_.exclusives()
-    except:  # if the board is in an unsolvable state, remove the guess from
-        # the target node in the original board, return it
-        board.nodes[node_index].possibilities.remove(guess)
-        return board
+def count_file(filename):
+    ''' count_file:
+    Counts the solutions of each board in the puzzle file (see `load_file`
+    for the formats), stopping at `Options.limit` solutions if it is set
+    (`--unique` sets it to 2, enough to tell a unique board apart).  With more
+    than one job the top level branches of each board are split across a pool
+    of worker processes.
+    '''
+    f = sys.stdin if filename == '-' else open(filename, 'r')
+    pool = None
+    if Options.jobs != 1:
+        pool = Pool(Options.jobs if Options.jobs > 0 else None)
+
+    totals = {}
+    for (header, rows) in read_grids(f, Options.size):
+        board = CompactBoard(Options.size)
+        try:
+            for i in range(board.width):
+                board.load_row(rows[i], i)
+            count = count_solutions(board, Options.limit, pool)
+        except CollisionError:
+            count = 0
+
+        label = str(count)
+        if Options.limit and count >= Options.limit:
+            label += "+"
+        print "{}: {} solution{}".format(header.strip(), label,
+                                         "" if count == 1 else "s")
+        kind = "unique" if count == 1 else \
+            "no solution" if count == 0 else "multiple"
+        totals[kind] = totals.get(kind, 0) + 1
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    print ", ".join("{} {}".format(totals.get(kind, 0), kind)
+                    for kind in ["unique", "multiple", "no solution"])
+
+
+def count_solutions(board, limit=0, pool=None):
+    ''' count_solutions:
+    Counts the solutions of a CompactBoard, up to `limit` if it is set.  The
+    board is propagated, then each candidate of the cell with the fewest
+    becomes a branch counted by `count_branch`, through the `pool` if there
+    is one.
+    '''
+    try:
+        deduce(board)
+        index = board.guess_cell()
+    except (CollisionError, NoPossibilityError):
+        return 0
+    if index is None:
+        return 1
+
+    branches = [(board.size, board.cells.tolist(), board.solved, index, guess,
+                 limit) for guess in board.possibilities(index)]
+    if pool:
+        counts = pool.imap_unordered(count_branch, branches)
+    else:
+        counts = imap(count_branch, branches)
+
+    total = 0
+    for count in counts:
+        total += count
+        if limit and total >= limit:
+            return limit
+
+    return total
+
+
+def count_branch(branch):
+    ''' count_branch:
+    Counts the solutions (up to the limit) of a board with a single guess
+    made, the branch being the board's size, cells and solved count, the
+    guessed cell and number and the limit.  This is what runs in the worker
+    processes.
+    '''
+    size, cells, solved, index, guess, limit = branch
+    board = CompactBoard(size, cells, solved)
+    try:
+        board.set_answer(index, guess)
+    except CollisionError:
+        return 0
+
+    count = 0
+    for board in explore(board):
+        count += 1
+        if limit and count >= limit:
+            break
+
+    return count
+
+
+def dlx_solve(board):
+    ''' dlx_solve:
+    Solves the board as an exact cover problem with Algorithm X.  The board's
+    answers are selected out of its Geometry's `dlx_rows`/`dlx_columns`
+    matrix and the rest is searched with `exact_cover`, the first solution is
+    then answered back onto the board.  Returns the board, unsolved if there
+    is no solution.
+    '''
+    rows = board.geometry.dlx_rows
+    width = board.width
+    columns = dict(enumerate(set(candidates)
+                             for candidates in board.geometry.dlx_columns))
+    solution = []
+    for (cell, answer) in enumerate(board.values()):
+        if not answer:
+            continue
+        candidate = cell * width + answer - 1
+        for constraint in rows[candidate]:
+            if constraint not in columns:  # clashes with an earlier answer
+                return board
+        dlx_select(columns, rows, candidate)
+
+    for solution in exact_cover(columns, rows, solution, board.stats):
+        values = board.values()
+        for candidate in solution:
+            cell = candidate / width
+            if not values[cell]:
+                board.set_answer(cell, candidate % width + 1)
+        break
+
+    return board
+
+
+def exact_cover(columns, rows, solution, stats=None, depth=1):
+    ''' exact_cover:
+    Algorithm X over a dict of constraint -> set of candidates still covering
+    it (`rows` being the constraints of each candidate).  Picks the constraint
+    with the fewest candidates, tries each in turn and yields every full
+    solution (as the list of candidates).  The columns are covered and
+    uncovered in place, the dict/set version of dancing links.  Choices
+    between more than one candidate count as guesses in the `stats`, and
+    those that come to nothing as backtracks.
+    '''
+    if not columns:
+        yield list(solution)
+        return
+
+    constraint = min(columns, key=lambda c: len(columns[c]))
+    choices = list(columns[constraint])
+    for candidate in choices:
+        if stats and len(choices) > 1:
+            stats.guess(depth)
+        solution.append(candidate)
+        removed = dlx_select(columns, rows, candidate)
+        found = None
+        for found in exact_cover(columns, rows, solution, stats,
+                                 depth + (len(choices) > 1)):
+            yield found
+        if stats and found is None and len(choices) > 1:
+            stats.backtracks += 1
+        dlx_deselect(columns, rows, candidate, removed)
+        solution.pop()
+
+
+def dlx_select(columns, rows, candidate):
+    ''' dlx_select:
+    Covers each constraint of the candidate, removing every other candidate
+    that shares one of them from the rest of the matrix.  Returns the removed
+    columns for `dlx_deselect`.
+    '''
+    removed = []
+    for constraint in rows[candidate]:
+        for other in columns[constraint]:
+            for other_constraint in rows[other]:
+                if other_constraint != constraint:
+                    columns[other_constraint].discard(other)
+        removed.append(columns.pop(constraint))
+
+    return removed
 
-    if board_.solved < 81:  # If the board didn't get unsolvable and didn't
-            # get solved, simulate again
-        return simulate_guess(board_)
 
-    return board_
+def dlx_deselect(columns, rows, candidate, removed):
+    ''' dlx_deselect:
+    Undoes a `dlx_select`, uncovering the constraints in reverse order.
+    '''
+    for constraint in reversed(rows[candidate]):
+        columns[constraint] = removed.pop()
+        for other in columns[constraint]:
+            for other_constraint in rows[other]:
+                if other_constraint != constraint:
+                    columns[other_constraint].add(other)
+
 
 if __name__ == "__main__":
+    nxt = None
     if len(sys.argv) > 1:
+        def pbatch(x): Options.batch = int(x)
+        def pcache(x): Options.cache = x
+        def pcache_size(x): Options.cache_size = int(x)
+        def pjobs(x): Options.jobs = int(x)
+        def psize(x): Options.size = int(x)
+        def pengine(x): Options.engine = x
+        def pstats(x): Options.stats = x
+        def pstrategies(x):
+            Options.strategies = Stats.strategies if x == "all" \
+                else x.split(",")
+        def pformat(x): Options.stats_format = x
         for arg in sys.argv[1:]:
-            if arg.startswith('-'):
+            if arg.startswith('-') and arg != '-':
+                nxt = None
                 if arg in ['-d', '--debug']:
                     Options.debug = True
                 elif arg in ['-e', '--euler']:
                     Options.euler = True
                 elif arg in ['-f', '--fancy']:
                     Options.fancy = True
+                elif arg in ['-c', '--compact']:
+                    Options.compact = True
+                elif arg in ['-j', '--jobs']:
+                    nxt = pjobs
+                elif arg in ['-n', '--size']:
+                    nxt = psize
+                elif arg in ['--count']:
+                    Options.mode = "count"
+                elif arg in ['-u', '--unique']:
+                    Options.mode = "count"
+                    Options.limit = 2
+                elif arg in ['--engine']:
+                    nxt = pengine
+                elif arg in ['--batch']:
+                    nxt = pbatch
+                elif arg in ['--cache']:
+                    nxt = pcache
+                elif arg in ['--cache-size']:
+                    nxt = pcache_size
+                elif arg in ['-s', '--stats']:
+                    nxt = pstats
+                elif arg in ['--stats-format']:
+                    nxt = pformat
+                elif arg in ['--strategies']:
+                    nxt = pstrategies
             else:
-                Options.filename = arg
-    load_file(Options.filename)
+                if nxt:
+                    nxt(arg)
+                    nxt = None
+                else:
+                    Options.filename = arg
+    if Options.mode == "count":
+        count_file(Options.filename)
+    else:
+        load_file(Options.filename)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+import struct
+import sys
+from array import array
+
+import solution
+
+# struct codes for the value widths, smallest first
+CODES = "bhiq"
+
+
+class Options:
+    index = False
+    source = None
+    target = None
+
+
+def value_code(low, high):
+    ''' value_code:
+    Returns the struct code of the narrowest integer holding `low` to `high`.
+    '''
+    for code in CODES:
+        bits = 8 * struct.calcsize(code) - 1
+        if -(1 << bits) <= low and high < (1 << bits):
+            return code
+    raise OverflowError("values past int64")
+
+
+def levels(filename):
+    ''' levels:
+    Generator over the levels of a text triangle, as lists of ints.
+    '''
+    for line in open(filename, 'r'):
+        if line.strip():
+            yield [int(value) for value in line.split(solution.SEPERATOR)]
+
+
+def convert(source, target):
+    ''' convert:
+    Writes the text triangle in `source` out as a binary triangle (see
+    solution.MappedTriangle) to `target`.  The file is read twice, first to
+    find the width the values need, then to write them out a level at a time.
+    With `--index` the best path weights are then built into it too.
+    '''
+    depth, low, high = 0, 0, 0
+    for level in levels(source):
+        if len(level) != depth + 1:
+            raise ValueError("level {} has {} values".format(depth,
+                                                             len(level)))
+        depth += 1
+        low, high = min(low, min(level)), max(high, max(level))
+
+    code = value_code(low, high)
+    typecode = [typecode for typecode in "bhil"
+                if array(typecode).itemsize == struct.calcsize(code)][0]
+    f = open(target, 'w+b')
+    f.write(solution.HEADER.pack(solution.MAGIC, depth, code, Options.index))
+    for level in levels(source):
+        values = array(typecode, level)
+        if sys.byteorder == "big":
+            values.byteswap()
+        values.tofile(f)
+
+    if Options.index:
+        f.truncate(solution.index_offset(depth, struct.calcsize(code)) +
+                   8 * depth * (depth + 1) / 2)
+        f.close()
+        build_index(target)
+    else:
+        f.close()
+    print("wrote {} levels of {} byte values to {}".format(
+        depth, struct.calcsize(code), target))
+
+
+def build_index(target):
+    ''' build_index:
+    Fills in the index of a binary triangle: the best path weight from each
+    value, reduced from the bottom up with a rolling row and written out a
+    level at a time.
+    '''
+    triangle = solution.MappedTriangle(target)
+    f = open(target, 'r+b')
+    row = []
+    for level in range(triangle.depth - 1, -1, -1):
+        values = triangle.values(level)
+        if row:
+            row = [value + max(row[i], row[i + 1])
+                   for (i, value) in enumerate(values)]
+        else:
+            row = list(values)
+        f.seek(triangle.index_offset + 8 * level * (level + 1) / 2)
+        f.write(struct.pack("<{}q".format(len(row)), *row))
+    f.close()
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        if arg.startswith('-'):
+            if arg in ['-i', '--index']:
+                Options.index = True
+        elif Options.source is None:
+            Options.source = arg
+        else:
+            Options.target = arg
+    if Options.target is None:
+        sys.exit("usage: convert.py [-i] TRIANGLE.txt TRIANGLE.bin")
+    convert(Options.source, Options.target)
@@ -1,12 +1,34 @@
 #!/usr/bin/env python2
+import heapq
+import mmap
+import re
+import struct
 import sys
+from array import array
+from itertools import count
+try:
+    import numpy
+except ImportError:
+    numpy = None
 SEPERATOR = ' '
+MAGIC = "TRI1"
+# magic, number of levels, struct code of the values, whether it has an index
+HEADER = struct.Struct("<4sIcB6x")
+WEIGHT = struct.Struct("<q")
 
 
 class Options:
     debug = False
+    engine = "nodes"
     euler = False
     filename = "67.txt"
+    goal = None
+    moves = None
+    overflow = False
+    start = (0, 0)
+    ties = False
+    top = 0
+    turns = None
 
 
 class Node:
@@ -101,6 +123,48 @@ class Triangle:
 
         return path
 
+    def best_paths(self, limit=0, ties=False):
+        ''' (public) best_paths:
+        Generator over the distinct paths from the top, best first, stopping
+        after `limit` of them (if set) or, with `ties`, once the paths are
+        worse than the best.  The search is best first over the partial
+        paths, ordered by the best total they can still reach (the sum so far
+        plus the weight of the last Node), so a path is yielded as soon as a
+        full one comes off the heap.  With only `limit - found` paths left to
+        find, the partial paths past that many best ones can't make it, so
+        the heap is cut back to them whenever it doubles, keeping it in
+        proportion to the paths asked for.  Partial paths share their common
+        start as (node, rest) chains.
+        '''
+        self.get_values()
+        root = self.levels[0][0]
+        order = count()
+        heap = [(-root.weight, next(order), root.value, root, None)]
+        best = root.weight
+        found = 0
+        while heap:
+            bound, _, total, node, chain = heapq.heappop(heap)
+            if ties and -bound < best:
+                return
+            chain = (node, chain)
+            if not node.left:
+                path = []
+                while chain:
+                    node, chain = chain
+                    path.append(node)
+                path.reverse()
+                yield path
+                found += 1
+                if limit and found >= limit:
+                    return
+                continue
+
+            for child in [node.left, node.right]:
+                heapq.heappush(heap, (-(total + child.weight), next(order),
+                                      total + child.value, child, chain))
+            if limit and len(heap) > 2 * (limit - found):
+                heap = heapq.nsmallest(limit - found, heap)
+
     def find_euler(self, path):
         ''' (public) find_euler:
         Finds the sum of the numbers on that path, used for solving the problem
@@ -131,15 +195,428 @@ class Triangle:
         return output
 
 
+class ArrayTriangle:
+    ''' ArrayTriangle:
+    Alternative to the Triangle (`--engine array`) without the Node objects,
+    each level is a flat array of its values.  The weights are reduced from
+    the bottom up in a single rolling row, so the working memory is the width
+    of the triangle rather than a Node (and its links) per value.
+    '''
+    def __init__(self):
+        self.levels = []
+
+    def add_level(self, values):
+        ''' (public) add_level:
+        Takes a list of strings representing the value for each node in the
+        level and adds them as the next level.
+        '''
+        self.levels.append(array('l', [int(value) for value in values]))
+
+    def get_values(self):
+        ''' (public) get_values:
+        Reduces the levels from the bottom up, the rolling row starts as the
+        bottom level and each level up replaces it with the level's values
+        plus the heavier of the two weights below each.  Returns the row for
+        the top level (the weight of the best path) and which way the heavier
+        side was for each value, a bytearray per level (1 for the right, the
+        right also winning ties like Node.calc_weight).
+        '''
+        row = list(self.levels[-1])
+        turns = []
+        for level in reversed(self.levels[:-1]):
+            turn = bytearray(len(level))
+            for i in range(len(level)):
+                left, right = row[i], row[i + 1]
+                if left > right:
+                    row[i] = level[i] + left
+                else:
+                    row[i] = level[i] + right
+                    turn[i] = 1
+            row.pop()
+            turns.append(turn)
+        turns.reverse()
+
+        return row, turns
+
+    def find_path(self):
+        ''' (public) find_path:
+        Follows the heavier sides down from the top, returning the values
+        along the path with the maximum value.
+        '''
+        row, turns = self.get_values()
+        index = 0
+        path = [self.levels[0][0]]
+        for (turn, level) in zip(turns, self.levels[1:]):
+            index += turn[index]
+            path.append(level[index])
+
+        return path
+
+    def find_euler(self, path):
+        ''' (public) find_euler:
+        Finds the sum of the values on that path (see Triangle.find_euler).
+        '''
+        return sum(path)
+
+    def __str__(self):
+        ''' (magic) __str__:
+        Returns a string representation of the triangle.
+        '''
+        node_size = len(str(max(self.levels[-1])))
+        line_length = (2 * len(self.levels[-1]) - 1) * node_size
+        space = ' ' * node_size
+        output = ""
+        for level in self.levels:
+            output += space.join(str(value) for value in level).center(
+                line_length) + '\n'
+
+        return output
+
+
+class StreamTriangle:
+    ''' StreamTriangle:
+    Alternative to the Triangle (`--engine stream`) that never holds the
+    triangle itself.  Each level is folded into the running row of the best
+    sums down to each value as it is added, top down, so only the widest row
+    is ever in memory.  To find the path back, which parent each best sum
+    came from is kept as a bitmap per level (bit `i` set for the parent
+    straight above, clear for the one up and to the left), in memory or
+    written out to the `turns` file, `--turns FILE`, for the triangles that
+    are too big for that.
+    '''
+    def __init__(self, turns=None):
+        self.row = []
+        self.depth = 0
+        self.turns = open(turns, 'w+b') if turns else None
+        self.bitmaps = []
+
+    def add_level(self, values):
+        ''' (public) add_level:
+        Takes a list of strings representing the value for each node in the
+        level and folds them into the running row.  Raises a ValueError if
+        the level isn't one wider than the last.
+        '''
+        values = [int(value) for value in values]
+        row = self.row
+        if len(values) != len(row) + 1:
+            raise ValueError("level {} has {} values".format(self.depth,
+                                                             len(values)))
+        bits = bytearray((len(values) + 7) / 8)
+        if row:
+            values[0] += row[0]
+            bits[0] = 1
+            for i in range(1, len(row)):
+                left, up = row[i - 1], row[i]
+                if up >= left:
+                    values[i] += up
+                    bits[i >> 3] |= 1 << (i & 7)
+                else:
+                    values[i] += left
+            values[-1] += row[-1]
+
+        self.row = values
+        self.depth += 1
+        if self.turns:
+            self.turns.write(bits)
+        else:
+            self.bitmaps.append(bits)
+
+    def bitmap(self, level, offset):
+        ''' (public) bitmap:
+        Returns the bitmap for a level, `offset` being where it starts in the
+        turns file.
+        '''
+        if not self.turns:
+            return self.bitmaps[level]
+        self.turns.seek(offset)
+        return bytearray(self.turns.read((level + 8) / 8))
+
+    def find_path(self):
+        ''' (public) find_path:
+        Starts from the best sum on the bottom row and follows the bitmaps back
+        up to the top.  As the values themselves are gone this returns the
+        index of the value on each level along the path with the maximum value.
+        '''
+        index = max(range(len(self.row)), key=self.row.__getitem__)
+        path = [index]
+        if self.turns:
+            self.turns.flush()
+            offset = self.turns.tell()
+        for level in range(self.depth - 1, 0, -1):
+            if self.turns:
+                offset -= (level + 8) / 8
+            bits = self.bitmap(level, offset if self.turns else None)
+            if not bits[index >> 3] & (1 << (index & 7)):
+                index -= 1
+            path.append(index)
+        path.reverse()
+
+        return path
+
+    def find_euler(self, path):
+        ''' (public) find_euler:
+        The sum along the path, this is the best sum where it ends.
+        '''
+        return self.row[path[-1]]
+
+
+class NumpyTriangle:
+    ''' NumpyTriangle:
+    Alternative to the Triangle (`--engine numpy`) for the very tall
+    triangles.  The whole file is parsed in one go into a flat array of the
+    values, level `k` being the `k + 1` values from `k * (k + 1) / 2`, and
+    each level's reduction is a handful of array operations rather than a
+    `calc_weight` per Node.  The path follows the same choices as
+    Triangle.find_path, ties included.
+    '''
+    def __init__(self):
+        self.values = None
+        self.depth = 0
+
+    def load(self, f):
+        ''' (public) load:
+        Reads all of the values from the open file, returning the number of
+        levels.  The values are kept in the smallest integer type that holds
+        them.  Raises a ValueError if a level isn't one wider than the last
+        or a value isn't a number.
+        '''
+        text = f.read()
+        depth = 0
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            width = len(line.split())
+            if width != depth + 1:
+                raise ValueError("level {} has {} values".format(depth, width))
+            depth += 1
+        # fromstring stops quietly at a bad number, so look for them first
+        bad = re.search(r'(?<!\S)(?![-+]?\d+(?!\S))\S+', text)
+        if bad:
+            raise ValueError("invalid number {}".format(bad.group()))
+        values = numpy.fromstring(text, numpy.int64, sep=' ')
+        if len(values):
+            values = values.astype(numpy.promote_types(
+                numpy.min_scalar_type(values.min()),
+                numpy.min_scalar_type(values.max())))
+        self.values = values
+        self.depth = depth
+        return depth
+
+    def level(self, k):
+        ''' (public) level:
+        Returns the values of level `k` (a view of the flat array).
+        '''
+        start = k * (k + 1) / 2
+        return self.values[start:start + k + 1]
+
+    def get_values(self):
+        ''' (public) get_values:
+        Reduces the levels from the bottom up as int64 rows, each level's
+        weights being its values plus the heavier of the two weights below.
+        Returns the top row and which way Triangle.find_path would turn from
+        each value, a bool array per level (True for the right, which it
+        takes when the right is heavier or, on a tie, not the smaller value).
+        With `--check-overflow`, an OverflowError is raised rather than
+        letting the int64 sums wrap around, though only when the biggest
+        values of the levels could add up to more than an int64 holds.
+        '''
+        top = numpy.iinfo(numpy.int64)
+        check = Options.overflow and sum(
+            int(abs(self.level(k).astype(numpy.int64)).max())
+            for k in range(self.depth)) > top.max
+
+        row = self.level(self.depth - 1).astype(numpy.int64)
+        turns = []
+        for k in range(self.depth - 2, -1, -1):
+            below = self.level(k + 1)
+            left, right = row[:-1], row[1:]
+            turn = (right > left) | ((right == left) & (below[:-1] <=
+                                                        below[1:]))
+            best = numpy.where(turn, right, left)
+            level = self.level(k).astype(numpy.int64)
+            if check and ((level > 0) & (best > top.max - level) |
+                          (level < 0) & (best < top.min - level)).any():
+                raise OverflowError("level {} overflows int64".format(k))
+            row = level + best
+            turns.append(turn)
+        turns.reverse()
+
+        return row, turns
+
+    def find_path(self):
+        ''' (public) find_path:
+        Follows the turns down from the top, returning the values along the
+        path with the maximum value.
+        '''
+        row, turns = self.get_values()
+        index = 0
+        path = [int(self.values[0])]
+        for (k, turn) in enumerate(turns):
+            index += int(turn[index])
+            path.append(int(self.level(k + 1)[index]))
+
+        return path
+
+    def find_euler(self, path):
+        ''' (public) find_euler:
+        Finds the sum of the values on that path (see Triangle.find_euler).
+        '''
+        return sum(path)
+
+
+class MappedTriangle:
+    ''' MappedTriangle:
+    A triangle in the binary format written by `convert.py`, memory mapped
+    rather than read in.  After the HEADER come the values, level by level,
+    as little endian integers of a fixed width, then optionally the index:
+    the best path weight from every value (what Triangle.get_values works
+    out), as int64s in the same order.  With the index the best weight from
+    any value is a single lookup and the path from it is a lookup per level,
+    without it the sub triangle below the value is reduced as an
+    ArrayTriangle.
+    '''
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.depth, code, self.indexed = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("{} is not a binary triangle".format(filename))
+        self.value_format = struct.Struct("<" + code)
+        self.itemsize = self.value_format.size
+        self.typecode = [typecode for typecode in "bhil"
+                         if array(typecode).itemsize == self.itemsize][0]
+        self.index_offset = index_offset(self.depth, self.itemsize)
+
+    def value(self, level, index):
+        ''' (public) value:
+        Returns the value at `index` on `level`.
+        '''
+        return self.value_format.unpack_from(
+            self.map, HEADER.size + (level * (level + 1) / 2 + index) *
+            self.itemsize)[0]
+
+    def values(self, level, start=0, stop=None):
+        ''' (public) values:
+        Returns an array of the values of `level`, from `start` up to `stop`.
+        '''
+        stop = level + 1 if stop is None else stop
+        offset = HEADER.size + (level * (level + 1) / 2) * self.itemsize
+        values = array(self.typecode, self.map[
+            offset + start * self.itemsize:offset + stop * self.itemsize])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def weight(self, level, index):
+        ''' (public) weight:
+        Returns the weight of the best path down from `index` on `level`, a
+        lookup in the index if there is one.
+        '''
+        if self.indexed:
+            return WEIGHT.unpack_from(self.map, self.index_offset + 8 * (
+                level * (level + 1) / 2 + index))[0]
+        return sum(self.subtriangle(level, index).find_path())
+
+    def subtriangle(self, level, index):
+        ''' (public) subtriangle:
+        Returns the triangle below (and including) `index` on `level` as an
+        ArrayTriangle.
+        '''
+        triangle = ArrayTriangle()
+        for depth in range(self.depth - level):
+            triangle.levels.append(self.values(level + depth, index,
+                                               index + depth + 1))
+        return triangle
+
+    def find_path(self, level=0, index=0):
+        ''' (public) find_path:
+        Returns the values along the path with the maximum value down from
+        `index` on `level` (`--from LEVEL,INDEX`), choosing between the
+        weights of the two values below at each step the same way as
+        Triangle.find_path.
+        '''
+        if not 0 <= index <= level < self.depth:
+            raise IndexError("no value {} on level {}".format(index, level))
+        if not self.indexed:
+            return self.subtriangle(level, index).find_path()
+        path = [self.value(level, index)]
+        for level in range(level + 1, self.depth):
+            left, right = self.weight(level, index), \
+                self.weight(level, index + 1)
+            if left < right or left == right and \
+                    self.value(level, index) <= self.value(level, index + 1):
+                index += 1
+            path.append(self.value(level, index))
+
+        return path
+
+    def find_euler(self, path):
+        ''' (public) find_euler:
+        Finds the sum of the values on that path (see Triangle.find_euler).
+        '''
+        return sum(path)
+
+
+def index_offset(depth, itemsize):
+    ''' index_offset:
+    Where the index starts in a binary triangle, after the values, rounded up
+    to a multiple of 8.
+    '''
+    end = HEADER.size + depth * (depth + 1) / 2 * itemsize
+    return (end + 7) / 8 * 8
+
+
 def load_triangle(filename):
     ''' load_triangle:
+    Reads the triangle in from the file (`-` for stdin), a level per line,
+    then finds the path with the maximum value (with `--engine array` as an
+    ArrayTriangle, with `--engine stream` a StreamTriangle as it is read and
+    with `--engine numpy` a NumpyTriangle, reading the file in one go).  A
+    binary triangle from `convert.py` is mapped as a MappedTriangle instead,
+    and the path found from `Options.start`.  With `--top N` or `--ties` the
+    best N paths or all of the paths tied for the best are printed too, from
+    the Node tree whatever the engine.
     '''
-    f = open(filename, 'r')
-    triangle = Triangle()
-    for line in f:
-        triangle.add_level(line.split(SEPERATOR))
+    if filename != '-' and open(filename, 'rb').read(len(MAGIC)) == MAGIC:
+        triangle = MappedTriangle(filename)
+        path = triangle.find_path(*Options.start)
+        if Options.debug:
+            print("Mapped {} levels{}".format(
+                triangle.depth, " with an index" if triangle.indexed else ""))
+            print("best from {}: {}".format(Options.start,
+                                            triangle.weight(*Options.start)))
+        if Options.euler:
+            print("euler answer: {}".format(triangle.find_euler(path)))
+        return
+    if Options.engine == "numpy" and numpy is None:
+        sys.exit("the numpy engine needs numpy")
+    f = sys.stdin if filename == '-' else open(filename, 'r')
+    if Options.top or Options.ties:
+        triangle = Triangle()
+    elif Options.engine == "stream":
+        triangle = StreamTriangle(Options.turns)
+    elif Options.engine == "array":
+        triangle = ArrayTriangle()
+    elif Options.engine == "numpy":
+        triangle = NumpyTriangle()
+    else:
+        triangle = Triangle()
+    levels = 0
+    if isinstance(triangle, NumpyTriangle):
+        levels = triangle.load(f)
+    else:
+        for line in f:
+            if not line.strip():
+                continue
+            triangle.add_level(line.split(SEPERATOR))
+            levels += 1
     if Options.debug:
-        print("Loaded {} levels".format(len(triangle.levels)))
+        print("Loaded {} levels".format(levels))
+
+    if Options.top or Options.ties:
+        for path in triangle.best_paths(Options.top, Options.ties):
+            print("{}: {}".format(triangle.find_euler(path),
+                                  " ".join(str(node) for node in path)))
 
     path = triangle.find_path()
 
@@ -147,14 +624,177 @@ def load_triangle(filename):
         print("euler answer: {}".format(triangle.find_euler(path)))
 
 
+def grid_rows(f):
+    ''' grid_rows:
+    Yields each row of the grid in the open file as a numpy array.  Raises a
+    ValueError at a value that isn't a number or a row that isn't as wide as
+    the first.
+    '''
+    width = None
+    for (number, line) in enumerate(f):
+        values = line.replace(',', ' ').split()
+        if not values:
+            continue
+        row = numpy.array(values, numpy.int64)
+        if width is None:
+            width = len(row)
+        elif len(row) != width:
+            raise ValueError("row {} has {} values, not {}".format(
+                number, len(row), width))
+        yield row
+
+
+def load_grid(filename):
+    ''' load_grid:
+    The rectangular version (`--grid MOVES`), reads a grid of numbers from
+    the file (`-` for stdin), a row per line with the numbers separated by
+    spaces or commas, and finds the minimal (or with `--max` the maximal)
+    path sum:
+    - `rd`, right and down from the top left to the bottom right
+    - `rud`, right, up and down from anywhere in the left column to anywhere
+      in the right column
+    - `all`, any of the four ways from the top left to the bottom right, the
+      minimum only as the values may not be revisited
+    The rows are numpy arrays, streamed through one at a time for `rd`.
+    '''
+    if numpy is None:
+        sys.exit("the grid paths need numpy")
+    goal = Options.goal or "min"
+    if Options.moves == "all" and goal != "min":
+        sys.exit("only the minimal path goes all four ways")
+    best = numpy.minimum if goal == "min" else numpy.maximum
+    f = sys.stdin if filename == '-' else open(filename, 'r')
+    rows = grid_rows(f)
+    if Options.moves == "rd":
+        total = grid_right_down(rows, best)
+    else:
+        grid = numpy.array(list(rows))
+        if Options.debug:
+            print("Loaded {} x {} grid".format(*grid.shape))
+        if Options.moves == "rud":
+            total = grid_right_up_down(grid, best)
+        elif Options.moves == "all":
+            total = grid_four_ways(grid)
+        else:
+            sys.exit("unknown moves {}".format(Options.moves))
+
+    if Options.euler:
+        print("euler answer: {}".format(total))
+
+
+def grid_right_down(rows, best):
+    ''' grid_right_down:
+    The best path sum moving right and down, a row at a time.  The running
+    row holds the best sum to each cell of the row, and the best sum to cell
+    `j` of the next row is the best over `k <= j` of coming down at `k` and
+    going right from there, `above[k] + sum(row[k:j + 1])`.  With `S` the
+    running sum of the row that is `S[j] + best(above[k] - S[k] + row[k])`,
+    a cumulative min (or max) rather than a loop over the cells.
+    '''
+    cost = None
+    for row in rows:
+        sums = numpy.cumsum(row)
+        if cost is None:
+            cost = sums
+        else:
+            cost = sums + best.accumulate(cost - sums + row)
+
+    return int(cost[-1])
+
+
+def grid_right_up_down(grid, best):
+    ''' grid_right_up_down:
+    The best path sum moving right, up and down, a column at a time.  Each
+    cell of a column is entered from the left (or is the start, for the
+    first), then the path goes straight up or straight down the column before
+    going right (turning back would revisit cells).  Both directions are
+    cumulative mins (or maxes) like in `grid_right_down`, the down one on the
+    column and the up one on the column flipped.
+    '''
+    cost = numpy.zeros(grid.shape[0], numpy.int64)
+    for j in range(grid.shape[1]):
+        column = grid[:, j]
+        enter = cost + column
+        sums = numpy.cumsum(column)
+        down = sums + best.accumulate(enter - sums)
+        sums = numpy.cumsum(column[::-1])
+        up = (sums + best.accumulate(enter[::-1] - sums))[::-1]
+        cost = best(down, up)
+
+    return int(best.reduce(cost))
+
+
+def grid_four_ways(grid):
+    ''' grid_four_ways:
+    The minimal path sum moving any of the four ways, Dijkstra's shortest
+    path from the top left to the bottom right with the cells weighted by
+    their values.  The distances are a flat array and the frontier a heap of
+    (distance, cell) pairs, cells already settled are skipped as they come
+    off the heap.
+    '''
+    height, width = grid.shape
+    values = array('l', grid.ravel().tolist())
+    cells = height * width
+    distance = array('l', [sys.maxint]) * cells
+    done = bytearray(cells)
+    distance[0] = values[0]
+    heap = [(values[0], 0)]
+    while heap:
+        cost, cell = heapq.heappop(heap)
+        if done[cell]:
+            continue
+        if cell == cells - 1:
+            return cost
+        done[cell] = 1
+        row, column = divmod(cell, width)
+        for (near, ok) in [(cell - width, row > 0),
+                           (cell + width, row < height - 1),
+                           (cell - 1, column > 0),
+                           (cell + 1, column < width - 1)]:
+            if ok and not done[near] and cost + values[near] < distance[near]:
+                distance[near] = cost + values[near]
+                heapq.heappush(heap, (distance[near], near))
+
+
 if __name__ == "__main__":
+    nxt = None
     if len(sys.argv) > 1:
+        def pengine(x): Options.engine = x
+        def pturns(x): Options.turns = x
+        def pstart(x): Options.start = tuple(int(i) for i in x.split(","))
+        def ptop(x): Options.top = int(x)
+        def pmoves(x): Options.moves = x
         for arg in sys.argv[1:]:
-            if arg.startswith('-'):
+            if arg.startswith('-') and arg != '-':
+                nxt = None
                 if arg in ['-d', '--debug']:
                     Options.debug = True
                 elif arg in ['-e', '--euler']:
                     Options.euler = True
+                elif arg in ['--engine']:
+                    nxt = pengine
+                elif arg in ['--turns']:
+                    nxt = pturns
+                elif arg in ['--check-overflow']:
+                    Options.overflow = True
+                elif arg in ['--from']:
+                    nxt = pstart
+                elif arg in ['-k', '--top']:
+                    nxt = ptop
+                elif arg in ['--ties']:
+                    Options.ties = True
+                elif arg in ['--grid']:
+                    nxt = pmoves
+                elif arg in ['--min']:
+                    Options.goal = "min"
+                elif arg in ['--max']:
+                    Options.goal = "max"
+            elif nxt:
+                nxt(arg)
+                nxt = None
             else:
                 Options.filename = arg
-    load_triangle(Options.filename)
+    if Options.moves:
+        load_grid(Options.filename)
+    else:
+        load_triangle(Options.filename)